@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Callable, Dict, List
+
+import whisper_output_splitter as splitter
+
+# Transcript lengths in seconds, from 1 minute to 10 hours
+TRANSCRIPT_DURATIONS = [60, 600, 3600, 36000]
+MEDIA_DURATIONS = [60, 600]
+# Seconds a CLI may take to get to work, job scripts start them thousands of times
+STARTUP_BUDGET = 0.5
+STARTUP_COMMANDS = {
+    'whisper_output_splitter --help': ['whisper_output_splitter.py', '--help'],
+    'scene_summarizer --help': ['scene_summarizer.py', '--help'],
+    'import whisper_output_splitter': ['-c', 'import whisper_output_splitter'],
+}
+VOCABULARY = ("and but so or yet the a we I you they were going to market then after that it's people really "
+              "family village war home children school remember always never mother father small groups chat rooms").split()
+
+
+class Suite(Enum):
+    ALL = 'all'
+    SPLITTER = 'splitter'
+    AUDIO = 'audio'
+    TRANSCRIBE = 'transcribe'
+    STARTUP = 'startup'
+
+
+def best_time(func: Callable, repeat: int) -> float:
+    # Best of repeat runs, the least noisy number on a shared machine
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def result(suite: Suite, name: str, size: str, seconds: float, items: int = None, **extra) -> Dict:
+    entry = {'suite': suite.value, 'name': name, 'size': size, 'seconds': round(seconds, 6)}
+    if items:
+        entry['items'] = items
+        entry['us_per_item'] = round(seconds / items * 1e6, 3)
+    entry.update(extra)
+    print(f"{suite.value:>10} {name:<28} {size:>8} {seconds:10.4f}s" + (f"  {entry['us_per_item']}us/item" if items else ""))
+    return entry
+
+
+def synthetic_transcript(duration: int, seed: int = 0) -> str:
+    # Whisper-like srt: a cue every ~4 seconds with 5 to 25 words and a bit of punctuation
+    rng = random.Random(seed)
+    cues = []
+    t = 0.0
+    index = 0
+    while t < duration:
+        index += 1
+        length = rng.uniform(2, 6)
+        words = [rng.choice(VOCABULARY) for _ in range(rng.randint(5, 25))]
+        for _ in range(rng.randint(0, 3)):
+            position = rng.randrange(len(words))
+            words[position] += rng.choice(',.?')
+        cues.append(f"{index}\n{splitter.convert_seconds_to_srt_time(t)} --> "
+                    f"{splitter.convert_seconds_to_srt_time(t + length)}\n {' '.join(words)}\n\n")
+        t += length
+    return ''.join(cues)
+
+
+def size_label(seconds: int) -> str:
+    return f"{seconds // 3600}h" if seconds >= 3600 else f"{seconds // 60}m"
+
+
+def bench_splitter(repeat: int) -> List[Dict]:
+    results = []
+    for duration in TRANSCRIPT_DURATIONS:
+        transcript = synthetic_transcript(duration)
+        cues = list(splitter.iter_cues(transcript.splitlines()))
+        times = [line.split(' --> ')[0] for line in transcript.splitlines() if ' --> ' in line]
+        seconds = [cue.start for cue in cues]
+        size = size_label(duration)
+
+        results.append(result(Suite.SPLITTER, 'convert_srt_time_to_seconds', size,
+                              best_time(lambda: [splitter.convert_srt_time_to_seconds(t) for t in times], repeat),
+                              len(times)))
+        results.append(result(Suite.SPLITTER, 'convert_seconds_to_srt_time', size,
+                              best_time(lambda: [splitter.convert_seconds_to_srt_time(s) for s in seconds], repeat),
+                              len(seconds)))
+        results.append(result(Suite.SPLITTER, 'split_text_into_chunks', size,
+                              best_time(lambda: [splitter.split_text_into_chunks(cue.text, cue.end - cue.start)
+                                                 for cue in cues], repeat), len(cues)))
+        results.append(result(Suite.SPLITTER, 'split_transcript', size,
+                              best_time(lambda: splitter.split_transcript(transcript), repeat), len(cues)))
+    return results
+
+
+def generate_media(path: str, duration: int):
+    # Small video with a stereo 48 kHz aac track, close enough to the camera files for the audio stages
+    subprocess.run(['ffmpeg', '-nostdin', '-y', '-loglevel', 'error',
+                    '-f', 'lavfi', '-i', f'testsrc=size=320x240:rate=10:duration={duration}',
+                    '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+                    '-ac', '2', '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', path], check=True)
+
+
+def bench_audio(repeat: int) -> List[Dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for duration in MEDIA_DURATIONS:
+            proj = splitter.Project('', work_dir, f"bench_{duration}.mp4", f"bench_{duration}.wav", '')
+            mpeg_path = os.path.join(work_dir, proj.mpeg_file)
+            generate_media(mpeg_path, duration)
+            size = size_label(duration)
+            # force, otherwise the manifest would skip every run after the first
+            results.append(result(Suite.AUDIO, 'extract_audio', size,
+                                  best_time(lambda: splitter.extract_audio(proj, force=True), repeat),
+                                  audio_seconds=duration))
+            results.append(result(Suite.AUDIO, 'extract_audio_single_pass', size,
+                                  best_time(lambda: splitter.extract_audio(proj, single_pass=True, force=True),
+                                            repeat), audio_seconds=duration))
+            results.append(result(Suite.AUDIO, 'read_audio_pcm', size,
+                                  best_time(lambda: splitter.read_audio_pcm(mpeg_path), repeat),
+                                  audio_seconds=duration))
+    return results
+
+
+def bench_transcribe(repeat: int, model_name: str, audio_path: str) -> List[Dict]:
+    # Real-time factor of the in-process backend with a small model on CPU. Needs speech, on a generated tone VAD
+    # drops most of the audio and the decoder has nothing to do, so the number would mean nothing
+    results = []
+    audio = splitter.read_audio_pcm(audio_path)
+    audio_seconds = len(audio) / 16000
+    for batch_size in (0, 8):
+        options = splitter.FasterWhisperOptions('cpu', 'int8', 1, batch_size)
+        model = splitter.get_faster_whisper_model(model_name, options)
+
+        def transcribe():
+            if batch_size:
+                from faster_whisper import BatchedInferencePipeline
+                segments, _ = BatchedInferencePipeline(model=model).transcribe(audio, batch_size=batch_size)
+            else:
+                segments, _ = model.transcribe(audio)
+            list(segments)
+
+        seconds = best_time(transcribe, repeat)
+        results.append(result(Suite.TRANSCRIBE, f"faster_whisper_batch_{batch_size}", size_label(int(audio_seconds)),
+                              seconds, audio_seconds=audio_seconds, model=model_name,
+                              real_time_factor=round(seconds / audio_seconds, 4)))
+    return results
+
+
+def bench_startup(repeat: int) -> List[Dict]:
+    # Wall time of a fresh interpreter running each CLI, this is what every job script pays
+    results = []
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name, command in STARTUP_COMMANDS.items():
+        def run():
+            subprocess.run([sys.executable] + command, cwd=package_dir, check=True, stdout=subprocess.DEVNULL)
+
+        seconds = best_time(run, repeat)
+        results.append(result(Suite.STARTUP, name, 'cli', seconds, budget=STARTUP_BUDGET,
+                              over_budget=seconds > STARTUP_BUDGET))
+    return results
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float) -> List[str]:
+    # Returns a line for every benchmark that got slower than the baseline by more than threshold
+    with open(baseline_path, 'r') as file:
+        baseline = {(r['suite'], r['name'], r['size']): r for r in json.load(file)['results']}
+    regressions = []
+    for entry in results:
+        before = baseline.get((entry['suite'], entry['name'], entry['size']))
+        if before and before['seconds'] and entry['seconds'] > before['seconds'] * (1 + threshold):
+            regressions.append(f"{entry['suite']} {entry['name']} {entry['size']}: "
+                               f"{before['seconds']:.4f}s -> {entry['seconds']:.4f}s")
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the splitter, audio extraction and transcription')
+    parser.add_argument('-s', '--suite', type=Suite, choices=list(Suite), default=Suite.SPLITTER, help='Which benchmarks to run')
+    parser.add_argument('-o', '--output', type=str, default='bench_results.json', help='Where to write the JSON results')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per benchmark, the best one is kept')
+    parser.add_argument('-l', '--model', type=str, default='tiny.en', help='faster_whisper model for the transcribe suite')
+    parser.add_argument('--audio', type=str, default=None,
+                        help='Media file with speech for the transcribe suite, which is skipped without it')
+    parser.add_argument('-c', '--compare', type=str, default=None, help='Baseline JSON results to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.10, help='Allowed slowdown against the baseline, 0.10 is 10%%')
+    args = parser.parse_args()
+    if args.suite == Suite.TRANSCRIBE and not args.audio:
+        parser.error('the transcribe suite needs --audio, a recording with speech')
+
+    results = []
+    if args.suite in [Suite.SPLITTER, Suite.ALL]:
+        results += bench_splitter(args.repeat)
+    if args.suite in [Suite.AUDIO, Suite.ALL]:
+        results += bench_audio(args.repeat)
+    if args.suite in [Suite.TRANSCRIBE, Suite.ALL]:
+        if args.audio:
+            results += bench_transcribe(args.repeat, args.model, args.audio)
+        else:
+            print("Skipping the transcribe suite, give --audio a recording with speech to run it")
+    if args.suite in [Suite.STARTUP, Suite.ALL]:
+        results += bench_startup(args.repeat)
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    failed = False
+    for entry in results:
+        if entry.get('over_budget'):
+            print(f"OVER BUDGET {entry['name']}: {entry['seconds']:.3f}s > {entry['budget']}s")
+            failed = True
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import re
+import wave
+from collections import namedtuple
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from srt_stream import Cue
+from word_timings import Word, WordSegment
+
+# start and end are in seconds from the start of the whole file
+Chunk = namedtuple('Chunk', ['start', 'end'])
+
+# Look this far either side of every chunk boundary for the quietest spot
+SEARCH_SECONDS = 20
+# RMS is measured over windows this long
+WINDOW_SECONDS = 0.1
+# A cue this close to the previous chunk's last cues with the same words is whisper repeating itself
+DEDUPE_SECONDS = 2.0
+_NON_WORD = re.compile(r'\W+')
+
+
+def _read_mono(wav_file: wave.Wave_read, start: float, end: float) -> np.ndarray:
+    rate = wav_file.getframerate()
+    wav_file.setpos(int(start * rate))
+    samples = np.frombuffer(wav_file.readframes(int((end - start) * rate)), dtype='<i2').astype(np.float32)
+    channels = wav_file.getnchannels()
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def quietest_point(wav_file: wave.Wave_read, start: float, end: float) -> float:
+    # Middle of the lowest energy window in [start, end)
+    samples = _read_mono(wav_file, start, end)
+    window = int(WINDOW_SECONDS * wav_file.getframerate())
+    if len(samples) < window:
+        return (start + end) / 2
+    frames = samples[:len(samples) // window * window].reshape(-1, window)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return start + (int(np.argmin(rms)) + 0.5) * WINDOW_SECONDS
+
+
+def plan_chunks(wav_path: str, chunk_seconds: float, duration: float = None) -> List[Chunk]:
+    """
+    Cuts the wav into chunks of about chunk_seconds, each cut at the quietest point within SEARCH_SECONDS of the
+    target so words aren't split in half. Only the audio around each cut is read.
+    A last piece shorter than a quarter chunk is folded into the one before it.
+    """
+    with wave.open(wav_path, 'rb') as wav_file:
+        total = wav_file.getnframes() / wav_file.getframerate()
+        if duration:
+            total = min(total, duration)
+        search = min(SEARCH_SECONDS, chunk_seconds / 4)
+        chunks = []
+        start = 0.0
+        while total - start > chunk_seconds * 1.25:
+            target = start + chunk_seconds
+            cut = quietest_point(wav_file, target - search, target + search)
+            chunks.append(Chunk(start, cut))
+            start = cut
+    chunks.append(Chunk(start, total))
+    return chunks
+
+
+def write_chunk_wav(wav_path: str, chunk: Chunk, chunk_path: str):
+    with wave.open(wav_path, 'rb') as wav_file:
+        rate = wav_file.getframerate()
+        wav_file.setpos(int(chunk.start * rate))
+        frames = wav_file.readframes(int(chunk.end * rate) - int(chunk.start * rate))
+        with wave.open(chunk_path, 'wb') as chunk_file:
+            chunk_file.setparams(wav_file.getparams())
+            chunk_file.writeframes(frames)
+
+
+def _normalized(text: str) -> str:
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+def _offset_segment(segment: WordSegment, offset_ms: int) -> WordSegment:
+    return WordSegment(segment.start + offset_ms, segment.end + offset_ms,
+                       [Word(w.start + offset_ms, w.end + offset_ms, w.word) for w in segment.words])
+
+
+def stitch_chunks(results: Iterable[Tuple[Chunk, List[Cue], List[WordSegment]]]
+                  ) -> Tuple[List[Cue], List[Optional[WordSegment]]]:
+    """
+    Joins per chunk transcripts (chunk relative times) into one, in chunk order. Times are shifted by the chunk
+    start and kept inside the chunk, cues starting past its end (whisper running on into the padding) and empty cues
+    are dropped, and a cue at the start of a chunk repeating one of the previous chunk's last cues is dropped.
+    whisper.cpp writes one json segment per srt cue, so segments[i] belongs to cues[i]. Cues are renumbered when
+    written.
+    """
+    cues: List[Cue] = []
+    segments: List[Optional[WordSegment]] = []
+    for chunk, chunk_cues, chunk_segments in results:
+        if len(chunk_segments) != len(chunk_cues):
+            chunk_segments = [None] * len(chunk_cues)
+        previous = [(_normalized(cue.text), cue.end) for cue in cues[-3:]]
+        for cue, segment in zip(chunk_cues, chunk_segments):
+            text = _normalized(cue.text)
+            if not text:
+                continue
+            start, end = max(cue.start, 0) + chunk.start, cue.end + chunk.start
+            if start >= chunk.end:
+                continue
+            if start < chunk.start + DEDUPE_SECONDS and any(
+                    text == prev_text and start - prev_end < DEDUPE_SECONDS for prev_text, prev_end in previous):
+                continue
+            cues.append(Cue(None, start, min(end, chunk.end), cue.text))
+            segments.append(_offset_segment(segment, round(chunk.start * 1000)) if segment else None)
+    return cues, segments
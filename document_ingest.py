@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'whisper_tools', 'documents')
+# Bump when a reader changes what it extracts, older cache entries are then ignored
+EXTRACTOR_VERSION = 1
+
+
+def iter_txt_paragraphs(file_path: str) -> Iterator[str]:
+    # Paragraphs with their newlines, read a line at a time
+    paragraph = []
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            paragraph.append(line)
+            if not line.strip():
+                yield ''.join(paragraph)
+                paragraph = []
+    if paragraph:
+        yield ''.join(paragraph)
+
+
+def iter_docx_paragraphs(file_path: str) -> Iterator[str]:
+    from docx import Document  # For .docx files
+    paragraphs = Document(file_path).paragraphs
+    for i, paragraph in enumerate(paragraphs):
+        yield paragraph.text + ("\n" if i + 1 < len(paragraphs) else "")
+
+
+def iter_pdf_pages(file_path: str) -> Iterator[str]:
+    try:
+        from PyPDF2 import PdfReader  # For .pdf files
+    except ImportError:
+        from pypdf import PdfReader  # PyPDF2's successor, same API
+    for page in PdfReader(file_path).pages:
+        yield page.extract_text()
+
+
+READERS = {
+    '.txt': iter_txt_paragraphs,
+    '.docx': iter_docx_paragraphs,
+    '.pdf': iter_pdf_pages,
+}
+
+
+def is_supported(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in READERS
+
+
+def extract_document(file_path: str) -> List[str]:
+    # Runs in a worker process. ''.join of the pieces is the document's text
+    return list(READERS[os.path.splitext(file_path)[1].lower()](file_path))
+
+
+def content_digest(file_path: str) -> str:
+    with open(file_path, 'rb') as file:
+        return hashlib.file_digest(file, 'sha256').hexdigest()
+
+
+class DocumentCache:
+    """Extracted text per document, keyed by the file's content hash, so renamed or touched files are not re-parsed."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.json")
+
+    def get(self, digest: str) -> Optional[List[str]]:
+        try:
+            with open(self._path(digest), 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return entry['pieces'] if entry.get('version') == EXTRACTOR_VERSION else None
+
+    def put(self, digest: str, pieces: List[str]):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'version': EXTRACTOR_VERSION, 'pieces': pieces}, file, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def iter_documents(files: Iterable[str], workers: int = None, cache_dir: Optional[str] = DEFAULT_CACHE_DIR
+                   ) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Yields (path, pieces) per supported document in the order given: paragraphs of .txt and .docx, pages of .pdf.
+    Documents not in the cache are parsed in a process pool, at most two per worker ahead of the one being
+    consumed, so a research folder streams through without being held in memory all at once. The pool is only
+    started for the first document that isn't cached.
+    cache_dir=None parses every document again.
+    """
+    cache = DocumentCache(cache_dir) if cache_dir else None
+    workers = workers or os.cpu_count() or 1
+    pool = None
+    # (path, digest, pieces or a future of them)
+    pending = deque()
+
+    def finish(file_path, digest, result):
+        if isinstance(result, list):
+            return file_path, result
+        pieces = result.result()
+        if cache is not None:
+            cache.put(digest, pieces)
+        return file_path, pieces
+
+    try:
+        for file_path in files:
+            if not is_supported(file_path):
+                print(f"Unsupported file format: {file_path}")
+                continue
+            digest = content_digest(file_path) if cache is not None else None
+            cached = cache.get(digest) if cache is not None else None
+            if cached is not None:
+                pending.append((file_path, digest, cached))
+            else:
+                if pool is None:
+                    pool = ProcessPoolExecutor(max_workers=workers)
+                pending.append((file_path, digest, pool.submit(extract_document, file_path)))
+            while len(pending) > workers * 2:
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
@@ -1,16 +1,35 @@
 from __future__ import print_function
+import argparse
+import json
 import os.path
 import pickle
-from typing import Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import urljoin
 
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
 
 # If modifying these SCOPES, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly',
           'https://www.googleapis.com/auth/drive.readonly']
 
+COMMENT_FIELDS = "nextPageToken, comments(id, content, createdTime, author(displayName))"
+# Drive takes up to 100 calls in one batch request, smaller batches stream out sooner and spread over the threads
+MAX_BATCH_SIZE = 100
+BATCH_SIZE = 25
+WORKERS = 4
+# Rate limited or failed calls in a batch are retried this many times, backing off
+RETRIES = 4
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Drive reports rate limits as 403 too, other 403s (no permission) are not retried
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
 def list_shared_drives(service) -> Dict[str, Dict]:
     """Lists all Shared Drives and prints their names and IDs."""
     page_token = None
@@ -85,19 +104,99 @@ def list_comments(service, file_id):
         response = service.comments().list(
             fileId=file_id,
             pageToken=page_token,
-            fields="nextPageToken, comments(id, content, createdTime, author(displayName))"
+            fields=COMMENT_FIELDS
         ).execute()
 
-        comments = response.get('comments', [])
-        if not comments:
-            break
-        all_comments.extend(comments)
+        all_comments.extend(response.get('comments', []))
 
         page_token = response.get("nextPageToken")
         if not page_token:
             break
 
-    return comments
+    return all_comments
+
+
+def is_retryable(exception: Exception) -> bool:
+    if not isinstance(exception, HttpError):
+        return False
+    if exception.resp.status in RETRY_STATUSES:
+        return True
+    if exception.resp.status != 403:
+        return False
+    try:
+        errors = json.loads(exception.content.decode('utf-8'))['error'].get('errors', [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return False
+    return any(error.get('reason') in RATE_LIMIT_REASONS for error in errors)
+
+
+def drive_batch_uri(api_endpoint: str) -> str:
+    # The client builds the batch URI from the discovery document, not from api_endpoint
+    return urljoin(api_endpoint, '/batch/drive/v3')
+
+
+def batch_list_comments(service, file_ids: Iterable[str], batch_uri: str = None) -> Dict[str, List[Dict]]:
+    """
+    All comments of several files, keyed by file ID. Each round is one HTTP batch request holding the next page of
+    every file that still has pages, so N files with one page each take one round-trip instead of N. Rate limits
+    are retried, a file the API refuses otherwise or still rate limits after RETRIES is skipped with a message.
+    """
+    all_comments = {file_id: [] for file_id in file_ids}
+    page_tokens = {file_id: None for file_id in all_comments}
+    attempt = 0
+    while page_tokens:
+        next_tokens, retry = {}, {}
+
+        def on_response(file_id, response, exception):
+            if exception is None:
+                all_comments[file_id].extend(response.get('comments', []))
+                if response.get('nextPageToken'):
+                    next_tokens[file_id] = response['nextPageToken']
+            elif attempt < RETRIES and is_retryable(exception):
+                retry[file_id] = page_tokens[file_id]
+            elif isinstance(exception, HttpError):
+                # e.g. no permission on this one file, or still rate limited after every retry. The other files
+                # are still dumped, with what this one had so far
+                given_up = f" after {RETRIES} retries" if is_retryable(exception) else ""
+                print(f"Skipping comments on {file_id}{given_up}: {exception.resp.status} {exception.reason}")
+            else:
+                raise exception
+
+        batch = (BatchHttpRequest(callback=on_response, batch_uri=batch_uri) if batch_uri
+                 else service.new_batch_http_request(callback=on_response))
+        for file_id, page_token in page_tokens.items():
+            batch.add(service.comments().list(fileId=file_id, pageToken=page_token, fields=COMMENT_FIELDS),
+                      request_id=file_id)
+        batch.execute()
+        if retry:
+            attempt += 1
+            time.sleep(2 ** attempt)
+        else:
+            attempt = 0
+        page_tokens = {**next_tokens, **retry}
+    return all_comments
+
+
+def iter_comments(make_service: Callable, files: Dict[str, Dict], workers: int = WORKERS,
+                  batch_size: int = BATCH_SIZE, batch_uri: str = None) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    Yields (name, comments) for every file, as each batch of batch_size files comes back. Up to workers batches
+    are in flight at once, each thread with its own service from make_service() since the HTTP client is not
+    thread safe.
+    """
+    local = threading.local()
+
+    def fetch(names):
+        if not hasattr(local, 'service'):
+            local.service = make_service()
+        comments = batch_list_comments(local.service, [files[name].get('id') for name in names], batch_uri)
+        return [(name, comments[files[name].get('id')]) for name in names]
+
+    names = list(files)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fetch, names[i:i + batch_size]) for i in range(0, len(names), batch_size)]
+        for future in as_completed(futures):
+            yield from future.result()
 
 def get_files_from_folder(service, shared_drive_id, folder_id) -> Dict:
     query = f"'{folder_id}' in parents"
@@ -129,10 +228,7 @@ def get_files_from_folder(service, shared_drive_id, folder_id) -> Dict:
             break
     return all_files
 
-def main():
-    """Shows basic usage of the Drive v3 API.
-    Lists the names and IDs of the first 10 files the user has access to.
-    """
+def get_credentials():
     creds = None
     # The file token.pickle stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first time.
@@ -151,20 +247,46 @@ def main():
         # Save the credentials for the next run
         with open('token.pickle', 'wb') as token:
             pickle.dump(creds, token)
+    return creds
+
+
+def main():
+    """
+    Prints the comments on every file in a folder of a Shared Drive, as they are fetched.
+    """
+    parser = argparse.ArgumentParser(description='Dump the comments on the files in a Shared Drive folder')
+    parser.add_argument('--drive', type=str, default='HFundsMarketing', help='Shared Drive name')
+    parser.add_argument('--folder', type=str, default='20250116_UkraineDeputy', help='Folder name in the Shared Drive')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Batch requests in flight at once')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE, help=f'Files per batch request, at most {MAX_BATCH_SIZE}')
+    parser.add_argument('--api_endpoint', type=str, default=None, help='Drive v3 base URL to use instead, e.g. a local fake: http://127.0.0.1:8080/drive/v3/')
+    parser.add_argument('--no_auth', action='store_true', help='Skip the OAuth login, for a local fake')
+    args = parser.parse_args()
+    if not 1 <= args.batch_size <= MAX_BATCH_SIZE:
+        parser.error(f"--batch_size must be between 1 and {MAX_BATCH_SIZE}, Drive's limit per batch request")
+
+    creds = None if args.no_auth else get_credentials()
+    client_options = {'api_endpoint': args.api_endpoint} if args.api_endpoint else None
+    batch_uri = drive_batch_uri(args.api_endpoint) if args.api_endpoint else None
+
+    def make_service():
+        # Build the Drive service. The discovery document ships with the client, building makes no request
+        if args.no_auth:
+            import httplib2
+            return build('drive', 'v3', http=httplib2.Http(), client_options=client_options)
+        return build('drive', 'v3', credentials=creds, client_options=client_options)
 
-    # Build the Drive service.
-    service = build('drive', 'v3', credentials=creds)
+    service = make_service()
 
     drives_dict = list_shared_drives(service)
 
-    shared_drive_name = 'HFundsMarketing' #Hfunds Marketing
+    shared_drive_name = args.drive #Hfunds Marketing
     shared_drive_id = drives_dict[shared_drive_name].get('id')
     all_folders = get_all_folders(service, shared_drive_id)
-    folder_id = all_folders['20250116_UkraineDeputy'].get('id')
+    folder_id = all_folders[args.folder].get('id')
     all_files = get_files_from_folder(service, shared_drive_id, folder_id)
 
-    for name, file in all_files.items():
-        comments = list_comments(service, file.get("id"))
+    for name, comments in iter_comments(make_service, all_files, args.workers, args.batch_size, batch_uri):
         for comment in comments:
             author = comment.get("author", {})
             print(f"{name} Author: {author.get("displayName", "Unknown")}, {comment.get("content")}")
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'whisper_tools', 'llm_cache.sqlite')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def cache_key(**params) -> str:
+    # Same model, messages and parameters, same key. Key order doesn't matter
+    return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM responses in SQLite. The least recently used entries are evicted once the responses add up
+    to more than max_bytes, and entries older than ttl_seconds (None keeps them) count as misses.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES, ttl_seconds: float = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, created REAL NOT NULL, expires REAL, accessed REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        # Kept up to date by put, get and _evict so a put doesn't sum the whole table
+        self._total = self._size()
+
+    def _size(self) -> int:
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT value, expires, size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row and row[1] is not None and row[1] < now:
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._total -= row[2]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str, ttl_seconds: float = None):
+        # ttl_seconds overrides the cache's TTL for this entry, e.g. for image URLs that expire
+        if value is None:
+            # e.g. a completion with no content, asked again next time
+            return
+        now = time.time()
+        ttl_seconds = ttl_seconds or self.ttl_seconds
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            replaced = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, value, size, now, now + ttl_seconds if ttl_seconds else None, now))
+            self._total += size - (replaced[0] if replaced else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Expired entries go first, then the least recently used until it fits. Summed again here rather than
+        # trusted, other processes may share the file
+        self._db.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?', (time.time(),))
+        self._total = self._size()
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall():
+            if self._total <= self.max_bytes:
+                break
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': entries, 'bytes': size}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
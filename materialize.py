@@ -0,0 +1,99 @@
+import os
+import shutil
+import subprocess
+import sys
+from enum import Enum
+from typing import Optional
+
+# ioctl request number for FICLONE on Linux (btrfs, xfs, bcachefs...)
+FICLONE = 0x40049409
+
+
+class Materialize(Enum):
+    AUTO = 'auto'
+    REFLINK = 'reflink'
+    HARDLINK = 'hardlink'
+    SYMLINK = 'symlink'
+    COPY = 'copy'
+
+
+def reflink(src: str, dst: str):
+    # Copy-on-write clone, raises OSError when the filesystem can't do it
+    if sys.platform == 'darwin':
+        # APFS clonefile
+        result = subprocess.run(['cp', '-c', src, dst], capture_output=True)
+        if result.returncode != 0:
+            raise OSError(f"clonefile failed: {result.stderr.decode(errors='replace').strip()}")
+        return
+    import fcntl
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.unlink(dst)
+            raise
+
+
+def is_materialized(src: str, dst: str, strategy: Materialize = Materialize.AUTO) -> bool:
+    # Same file, or same size and mtime (within a second, some filesystems only keep seconds), in the form strategy
+    # asks for: a symlink or hardlink to src, or a file of its own for a reflink or copy. AUTO takes any of them
+    if not os.path.exists(dst):
+        return False
+    is_link = os.path.islink(dst)
+    same_file = os.path.samefile(src, dst)
+    if strategy == Materialize.SYMLINK:
+        return is_link and same_file
+    if strategy == Materialize.HARDLINK:
+        return same_file and not is_link
+    if strategy != Materialize.AUTO and (is_link or same_file):
+        return False
+    if same_file:
+        return True
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    return src_stat.st_size == dst_stat.st_size and abs(src_stat.st_mtime - dst_stat.st_mtime) < 1
+
+
+def _materialize_with(src: str, tmp_path: str, strategy: Materialize):
+    if strategy == Materialize.REFLINK:
+        reflink(src, tmp_path)
+        shutil.copystat(src, tmp_path)
+    elif strategy == Materialize.HARDLINK:
+        os.link(src, tmp_path)
+    elif strategy == Materialize.SYMLINK:
+        os.symlink(os.path.abspath(src), tmp_path)
+    else:
+        # copy2 keeps the mtime, so the next run sees the file as already materialized
+        shutil.copy2(src, tmp_path)
+
+
+def materialize(src: str, dst: str, strategy: Materialize = Materialize.AUTO) -> Optional[Materialize]:
+    """
+    Make src available at dst without copying the bytes when possible.
+    AUTO tries a reflink, then a hardlink when on the same device, and falls back to a symlink;
+    a full copy only happens when COPY is asked for. Returns the strategy that was used, or None when
+    dst already had the same size and mtime as src, made the way strategy asks for, and was left alone.
+    """
+    if is_materialized(src, dst, strategy):
+        return None
+    if strategy == Materialize.AUTO:
+        candidates = [Materialize.REFLINK]
+        if os.stat(src).st_dev == os.stat(os.path.dirname(os.path.abspath(dst))).st_dev:
+            candidates.append(Materialize.HARDLINK)
+        candidates.append(Materialize.SYMLINK)
+    else:
+        candidates = [strategy]
+
+    # Build next to dst and rename over it, so an interrupted run never leaves a half written file
+    tmp_path = f"{dst}.tmp"
+    for candidate in candidates:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        try:
+            _materialize_with(src, tmp_path, candidate)
+        except OSError:
+            if candidate == candidates[-1]:
+                raise
+            continue
+        os.replace(tmp_path, dst)
+        return candidate
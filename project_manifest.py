@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import uuid
+from typing import Dict, List
+
+from run_report import recorder
+
+MANIFEST_FILE = '.whisper_manifest.{name}.json'
+
+
+class ProjectManifest:
+    """
+    Records, per project, what each stage was built from so a re-run can skip stages whose inputs
+    (content hashes of files plus settings like model, duration and max_words) have not changed.
+
+    One file per project (named after its mpeg file), since -o can put several projects in one folder.
+    File hashes are memoized by inode, size and mtime, so a multi-GB mp4 is only hashed again when it changes, and
+    a source and its hard or symbolic linked project copy are hashed once.
+    """
+
+    def __init__(self, output_path: str, name: str):
+        self.project = os.path.join(output_path, name)
+        self.path = os.path.join(output_path, MANIFEST_FILE.format(name=name))
+        self.data = {'files': {}, 'stages': {}}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                self.data = json.load(file)
+
+    def file_digest(self, file_path: str) -> str:
+        # Follows symbolic links, so a link and its target share one entry
+        stat = os.stat(file_path)
+        key = f"{stat.st_dev}:{stat.st_ino}"
+        known = self.data['files'].get(key)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+        with open(file_path, 'rb') as file:
+            digest = hashlib.file_digest(file, 'sha256').hexdigest()
+        self.data['files'][key] = {'path': os.path.abspath(file_path), 'size': stat.st_size,
+                                   'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+        return digest
+
+    @staticmethod
+    def file_stamp(file_path: str) -> str:
+        # Which file and which version of it, without reading it: for inputs only linked or copied, whose content
+        # is hashed further down the pipeline anyway
+        stat = os.stat(file_path)
+        return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def is_fresh(self, stage: str, inputs: Dict, outputs: List[str]) -> bool:
+        recorded = self.data['stages'].get(stage)
+        if not recorded or recorded['inputs'] != inputs:
+            return False
+        return all(os.path.exists(output) for output in outputs)
+
+    def record(self, stage: str, inputs: Dict, outputs: List[str]):
+        self.data['stages'][stage] = {'inputs': inputs, 'outputs': outputs}
+        self.save()
+
+    def invalidate(self, stage: str):
+        if self.data['stages'].pop(stage, None) is not None:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.data, file, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_stage_cached(manifest: ProjectManifest, stage: str, inputs: Dict, outputs: List[str], func, force=False):
+    """
+    Run func() unless the manifest says stage was already built from the same inputs and its outputs exist.
+    Returns True when func ran.
+    """
+    with recorder.stage(manifest.project, stage):
+        if not force and manifest.is_fresh(stage, inputs, outputs):
+            print(f"Skipping {stage}, up to date: {', '.join(outputs)}")
+            recorder.set_status('skipped')
+            return False
+        # Forget the old record first, so a crash half way doesn't leave a stale stage looking fresh
+        manifest.invalidate(stage)
+        func()
+        manifest.record(stage, inputs, outputs)
+        return True
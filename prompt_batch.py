@@ -0,0 +1,86 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+# Separates prompts in a --prompts_file, prompts themselves may contain blank lines
+PROMPT_SEPARATOR = '---'
+
+
+def read_prompts_file(path: str) -> List[str]:
+    # A JSON list of strings, or plain text with prompts separated by lines of just ---
+    with open(path, 'r', encoding='utf-8') as file:
+        content = file.read()
+    if path.endswith('.json'):
+        return [prompt for prompt in json.loads(content) if prompt.strip()]
+    prompts, current = [], []
+    for line in content.splitlines(keepends=True):
+        if line.strip() == PROMPT_SEPARATOR:
+            prompts.append(''.join(current))
+            current = []
+        else:
+            current.append(line)
+    prompts.append(''.join(current))
+    return [prompt.strip('\n') + '\n\n' for prompt in prompts if prompt.strip()]
+
+
+class ResultStore:
+    """
+    Answers of a prompt batch, one JSON line per (file, prompt, model), appended and flushed as each finishes.
+    Re-running the batch skips everything already in the file, so an interrupted run picks up where it stopped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.results: Dict[Tuple[str, str, str], dict] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The line being written when the last run stopped
+                        continue
+                    self.results[(record['file'], record['prompt'], record['model'])] = record
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b'\n'
+
+    def has(self, file: str, prompt: str, model: str) -> bool:
+        return (file, prompt, model) in self.results
+
+    def add(self, file: str, prompt: str, model: str, answer: str):
+        record = {'file': file, 'prompt': prompt, 'model': model, 'answer': answer,
+                  'created': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+        self.results[(file, prompt, model)] = record
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class RateLimiter:
+    """Spaces requests out to at most requests_per_minute, shared by every task on the event loop."""
+
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
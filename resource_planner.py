@@ -0,0 +1,158 @@
+import json
+import math
+import os
+import platform
+import queue
+import shutil
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+# jobs whisper processes run at once, each with threads threads, pinned to one entry of cpu_sets (None: not pinned)
+Layout = namedtuple('Layout', ['jobs', 'threads', 'cpu_sets'])
+
+# whisper.cpp stops getting much faster past ~8 threads, more parallel jobs use the rest of the box better
+TARGET_THREADS_PER_JOB = 8
+MIN_THREADS_PER_JOB = 2
+CALIBRATION_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'whisper_tools', 'layouts.json')
+
+
+def available_cpus() -> List[int]:
+    # The CPUs this process may run on (taskset, cpusets), all of them where the OS can't tell
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cgroup_cpu_quota() -> Optional[float]:
+    # CPUs worth of time the container may use, None when unlimited (cgroup v2 cpu.max, then v1 cfs quota)
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as file:
+            quota, period = file.read().split()[:2]
+        return None if quota == 'max' else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', 'r') as file:
+            quota = int(file.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us', 'r') as file:
+            period = int(file.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def usable_cores() -> int:
+    cores = len(available_cpus())
+    quota = cgroup_cpu_quota()
+    if quota:
+        cores = min(cores, max(1, math.floor(quota)))
+    return cores
+
+
+def split_cpus(cpus: List[int], jobs: int, threads: int) -> List[Optional[List[int]]]:
+    # Disjoint, contiguous CPU sets per job so jobs don't fight over cores (or share caches needlessly)
+    if jobs * threads > len(cpus):
+        return [None] * jobs
+    return [cpus[k * threads:(k + 1) * threads] for k in range(jobs)]
+
+
+def make_layout(jobs: int, cores: int = None, threads: int = None) -> Layout:
+    # threads defaults to an even share of the cores
+    cores = cores or usable_cores()
+    jobs = max(1, min(jobs, cores))
+    threads = threads or max(1, cores // jobs)
+    return Layout(jobs, threads, split_cpus(available_cpus(), jobs, threads))
+
+
+def plan_layout(n_projects: int, model_name: str = None, jobs: int = None, threads: int = None) -> Layout:
+    """
+    How many whisper jobs to run at once and with how many threads each. jobs and threads given on the command line
+    win, then a calibrated layout for this machine and model, otherwise aim for TARGET_THREADS_PER_JOB threads per
+    job. Never more jobs than projects, the spare cores go to the jobs that do run.
+    """
+    cores = usable_cores()
+    if not jobs:
+        calibrated = load_calibrated_layout(model_name, cores) if model_name else None
+        jobs = calibrated.jobs if calibrated else max(1, cores // TARGET_THREADS_PER_JOB)
+    return make_layout(min(jobs, max(1, n_projects)), cores, threads)
+
+
+def pinned_command(cmd: str, cpus: Optional[List[int]]) -> str:
+    # Starts the shell command under taskset, so it is on its cores before its first thread. Pinning after Popen
+    # missed the threads started meanwhile, and preexec_fn isn't safe with the worker threads. Without taskset
+    # (macOS has no affinity at all) the command runs unpinned
+    if not cpus or not shutil.which('taskset'):
+        return cmd
+    return f"taskset -c {','.join(map(str, cpus))} {cmd}"
+
+
+class CorePool:
+    """Hands out the layout's CPU sets, one per running whisper job."""
+
+    def __init__(self, layout: Layout):
+        self.layout = layout
+        self._free = queue.Queue()
+        for cpus in layout.cpu_sets:
+            self._free.put(cpus)
+
+    @contextmanager
+    def slot(self):
+        cpus = self._free.get()
+        try:
+            yield cpus
+        finally:
+            self._free.put(cpus)
+
+
+def _calibration_key(model_name: str, cores: int) -> str:
+    return f"{platform.node()}:{cores}:{model_name}"
+
+
+def load_calibrated_layout(model_name: str, cores: int) -> Optional[Layout]:
+    try:
+        with open(CALIBRATION_FILE, 'r') as file:
+            entry = json.load(file).get(_calibration_key(model_name, cores))
+    except (OSError, ValueError):
+        return None
+    return Layout(entry['jobs'], entry['threads'], None) if entry else None
+
+
+def save_calibrated_layout(model_name: str, cores: int, layout: Layout, throughput: float):
+    os.makedirs(os.path.dirname(CALIBRATION_FILE), exist_ok=True)
+    try:
+        with open(CALIBRATION_FILE, 'r') as file:
+            layouts = json.load(file)
+    except (OSError, ValueError):
+        layouts = {}
+    layouts[_calibration_key(model_name, cores)] = {'jobs': layout.jobs, 'threads': layout.threads,
+                                                    'audio_seconds_per_second': round(throughput, 3)}
+    with open(CALIBRATION_FILE, 'w') as file:
+        json.dump(layouts, file, indent=2)
+
+
+def candidate_layouts(cores: int) -> List[Layout]:
+    # 1, 2, 4... jobs while each still gets MIN_THREADS_PER_JOB threads
+    layouts = []
+    jobs = 1
+    while jobs == 1 or cores // jobs >= MIN_THREADS_PER_JOB:
+        layouts.append(make_layout(jobs, cores))
+        jobs *= 2
+    return layouts
+
+
+def calibrate(run_trial: Callable[[Layout], float], model_name: str) -> Layout:
+    """
+    Runs run_trial for each candidate layout, it returns the throughput (audio seconds per wall second).
+    The fastest layout is saved for this machine and model, plan_layout picks it up from then on.
+    """
+    cores = usable_cores()
+    best, best_throughput = None, 0.0
+    for layout in candidate_layouts(cores):
+        throughput = run_trial(layout)
+        print(f"{layout.jobs} jobs x {layout.threads} threads: {throughput:.2f} audio seconds per second")
+        if throughput > best_throughput:
+            best, best_throughput = layout, throughput
+    save_calibrated_layout(model_name, cores, best, best_throughput)
+    print(f"Fastest: {best.jobs} jobs x {best.threads} threads, saved to {CALIBRATION_FILE}")
+    return best
@@ -0,0 +1,153 @@
+import csv
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+# ru_maxrss is in kilobytes on Linux and bytes on macOS
+_MAXRSS_TO_KB = 1 / 1024 if sys.platform == 'darwin' else 1
+# ru_inblock / ru_oublock count 512 byte blocks
+_BLOCK_SIZE = 512
+_RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', None)
+
+REPORT_FIELDS = ['project', 'stage', 'status', 'wall_seconds', 'cpu_seconds', 'peak_rss_kb', 'process_peak_rss_kb',
+                 'read_bytes', 'write_bytes', 'usage_scope', 'audio_seconds', 'real_time_factor', 'subprocesses',
+                 'error']
+
+
+def _thread_usage():
+    # (cpu seconds, blocks read, blocks written) of the calling thread
+    if _RUSAGE_THREAD is None:
+        return time.thread_time(), 0, 0
+    usage = resource.getrusage(_RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime, usage.ru_inblock, usage.ru_oublock
+
+
+def _process_usage():
+    # The same for every thread of this process, children excluded, their usage is charged per subprocess
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_inblock, usage.ru_oublock
+
+
+class RunRecorder:
+    """
+    Collects wall time, CPU time, peak memory, block I/O and audio duration for every stage of every project.
+    A stage runs in one thread, so subprocesses started while it runs are charged to it through a thread local.
+
+    CPU and block I/O of the stage itself are the calling thread's (usage_scope 'thread'). A stage whose work runs on
+    threads it doesn't own, like CTranslate2's inference threads, calls use_process_usage() and is charged the whole
+    process's usage over the stage instead (usage_scope 'process'), which includes any stages running alongside it.
+    """
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, project: str, stage: str):
+        record = {'project': project, 'stage': stage, 'status': 'ok', 'cpu_seconds': 0.0, 'peak_rss_kb': 0,
+                  'read_bytes': 0, 'write_bytes': 0, 'audio_seconds': None, 'real_time_factor': None,
+                  'usage_scope': 'thread', 'subprocesses': [], 'error': None}
+        previous = getattr(self._local, 'record', None)
+        self._local.record = record
+        thread_start = _thread_usage()
+        process_start = _process_usage()
+        wall_start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record['status'] = 'failed'
+            record['error'] = str(e)
+            raise
+        finally:
+            record['wall_seconds'] = round(time.perf_counter() - wall_start, 3)
+            if record['usage_scope'] == 'process':
+                start, end = process_start, _process_usage()
+            else:
+                start, end = thread_start, _thread_usage()
+            record['cpu_seconds'] = round(record['cpu_seconds'] + end[0] - start[0], 3)
+            record['read_bytes'] += (end[1] - start[1]) * _BLOCK_SIZE
+            record['write_bytes'] += (end[2] - start[2]) * _BLOCK_SIZE
+            record['process_peak_rss_kb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_TO_KB)
+            if record['audio_seconds'] and record['status'] == 'ok':
+                record['real_time_factor'] = round(record['wall_seconds'] / record['audio_seconds'], 4)
+            self._local.record = previous
+            with self._lock:
+                self.records.append(record)
+
+    @contextmanager
+    def charge_to(self, record: Dict):
+        # Subprocesses a stage starts from its own helper threads are charged to the stage's record
+        previous = getattr(self._local, 'record', None)
+        self._local.record = record
+        try:
+            yield record
+        finally:
+            self._local.record = previous
+
+    def current(self) -> Dict:
+        return getattr(self._local, 'record', None)
+
+    def set_status(self, status: str):
+        record = self.current()
+        if record is not None:
+            record['status'] = status
+
+    def use_process_usage(self):
+        # The current stage's CPU and I/O are measured for the whole process, see the class docstring
+        record = self.current()
+        if record is not None:
+            record['usage_scope'] = 'process'
+
+    def set_audio_seconds(self, seconds: float):
+        record = self.current()
+        if record is not None and seconds:
+            record['audio_seconds'] = round(seconds, 3)
+
+    def record_subprocess(self, cmd, wall_seconds: float, usage):
+        # usage is the rusage of the finished child from os.wait4, it includes the children it waited for
+        record = self.current()
+        if record is None:
+            return
+        entry = {'cmd': cmd if isinstance(cmd, str) else ' '.join(map(str, cmd)), 'wall_seconds': round(wall_seconds, 3)}
+        if usage is not None:
+            entry.update(cpu_seconds=round(usage.ru_utime + usage.ru_stime, 3),
+                         peak_rss_kb=round(usage.ru_maxrss * _MAXRSS_TO_KB),
+                         read_bytes=usage.ru_inblock * _BLOCK_SIZE, write_bytes=usage.ru_oublock * _BLOCK_SIZE)
+        with self._lock:
+            if usage is not None:
+                record['cpu_seconds'] += entry['cpu_seconds']
+                record['peak_rss_kb'] = max(record['peak_rss_kb'], entry['peak_rss_kb'])
+                record['read_bytes'] += entry['read_bytes']
+                record['write_bytes'] += entry['write_bytes']
+            record['subprocesses'].append(entry)
+
+    def write(self, json_path: str, csv_path: str = None):
+        with self._lock:
+            records = list(self.records)
+        os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+        with open(json_path, 'w') as file:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'stages': records}, file, indent=2)
+        if csv_path:
+            with open(csv_path, 'w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=REPORT_FIELDS)
+                writer.writeheader()
+                for record in records:
+                    writer.writerow(dict(record, subprocesses=len(record['subprocesses'])))
+
+
+def wait_with_rusage(process):
+    # Like process.wait(), but also returns the child's resource usage where the OS can tell us
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage
+
+
+recorder = RunRecorder()
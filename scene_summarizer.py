@@ -1,108 +1,323 @@
 import argparse
+import asyncio
 import os
 import pprint
+import sys
 from os.path import join, dirname
 
-import pysrt
 from enum import Enum
-from openai import OpenAI
+from functools import lru_cache
 
 from dotenv import load_dotenv
 
+from llm_cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, ResponseCache, cache_key
+
 # Example usage
 dotenv_path = join(dirname(__file__), '.env')
 load_dotenv()
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 OPENAI_API_MODEL = os.environ.get("OPENAI_API_MODEL")
-print(OPENAI_API_KEY)
-print(OPENAI_API_MODEL)
+# Transcript tokens per request, well inside the context window with room for the prompt and the answer
+WINDOW_TOKENS = 3000
+# Requests in flight at once
+CONCURRENCY = 4
+# Generated image URLs stop working after an hour
+IMAGE_URL_TTL = 3600
+# Passages retrieved from the index per question
+TOP_K = 8
+# Batch mode requests per minute, across all transcripts and prompts
+REQUESTS_PER_MINUTE = 60
+
+PROMPTS = [
+    "Can you identify when a question is asked in the script and what the answer is.\n\n"
+    "Format the output with timestamp\nQuestion: Answer: \n\n"
+]
+
+_cache = None
+_cache_disabled = False
+
+
+@lru_cache(maxsize=None)
+def openai_client():
+    # One client for the whole run, every call reuses its connection pool.
+    # openai is slow to import, load it the first time a client is needed
+    from openai import OpenAI
+    return OpenAI()
+
+def new_async_openai_client():
+    # Bound to the event loop it is used in, so one per asyncio.run, shared by all of its requests.
+    # OPENAI_BASE_URL (or --base_url) points both clients at any OpenAI compatible server, e.g. a local stub
+    from openai import AsyncOpenAI
+    return AsyncOpenAI()
+
+def configure_cache(path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=None, enabled=True):
+    global _cache, _cache_disabled
+    if _cache:
+        _cache.close()
+    _cache = ResponseCache(path, max_bytes, ttl_seconds) if enabled else None
+    _cache_disabled = not enabled
+
+def response_cache():
+    # The default cache unless configure_cache said otherwise
+    if _cache is None and not _cache_disabled:
+        configure_cache()
+    return _cache
+
+def chat_completion(**params):
+    # The answer's text, from the cache when the same model, messages and parameters were asked before
+    client = openai_client()
+    cache = response_cache()
+    key = cache_key(kind="chat", base_url=str(client.base_url), **params)
+    if cache and (content := cache.get(key)) is not None:
+        return content
+    content = client.chat.completions.create(**params).choices[0].message.content
+    if cache:
+        cache.put(key, content)
+    return content
+
+async def chat_completion_async(client, limiter=None, **params):
+    # limiter (a prompt_batch.RateLimiter) only spaces out the requests that actually go to the API
+    cache = response_cache()
+    key = cache_key(kind="chat", base_url=str(client.base_url), **params)
+    if cache and (content := cache.get(key)) is not None:
+        return content
+    if limiter:
+        await limiter.wait()
+    completion = await client.chat.completions.create(**params)
+    content = completion.choices[0].message.content
+    if cache:
+        cache.put(key, content)
+    return content
 
 def run_open_ai_completion_as_role(role="user", content="write a haiku about ai"):
-    client = OpenAI()
-    completion = client.chat.completions.create(
+    answer = chat_completion(
         model=OPENAI_API_MODEL,
         store=True,
         messages=[
             {"role": role, "content": content}
         ]
     )
-    print(completion.choices[0].message)
+    print(answer)
 
 def read_srt_file_segments(file_path):
-    subs = pysrt.open(file_path)
-    segments = []
-
-    for sub in subs:
-        segments.append({
-            "index": sub.index,
-            "start_time": sub.start.to_time(),  # Convert timestamp to time object
-            "end_time": sub.end.to_time(),
-            "text": sub.text.replace('\n', ' ')  # Clean up multiline text
-        })
-
-    return segments
-
-def analyze_emotions(segments):
-    text = "\n".join([f"{seg['start_time']}: {seg['text']}" for seg in segments])
-    prompt_text = (
+    # Returns a SubtitleTable, numpy is only imported once transcripts are actually loaded
+    from subtitle_table import SubtitleTable
+    return SubtitleTable.read_srt(file_path)
+
+def count_tokens(text):
+    # tiktoken when it is installed, otherwise the usual ~4 characters per token for English
+    try:
+        import tiktoken
+    except ImportError:
+        return len(text) // 4 + 1
+    return len(tiktoken.get_encoding("cl100k_base").encode(text))
+
+def split_into_windows(segments, lines, window_tokens=WINDOW_TOKENS):
+    """
+    Cuts a SubtitleTable into consecutive windows of whole segments whose prompt lines (lines[i] is segment i's)
+    fit in window_tokens. Returns (window, its lines) pairs, each window keeps its segments' timestamps.
+    """
+    windows = []
+    first = 0
+    used = 0
+    for i, line in enumerate(lines):
+        tokens = count_tokens(line) + 1
+        if used and used + tokens > window_tokens:
+            windows.append((segments.take(range(first, i)), lines[first:i]))
+            first, used = i, 0
+        used += tokens
+    if first < len(lines):
+        windows.append((segments.take(range(first, len(lines))), lines[first:]))
+    return windows
+
+async def _complete_windows(client, windows, system_prompt, instructions, semaphore, limiter=None):
+    async def complete(window_lines):
+        async with semaphore:
+            return await chat_completion_async(
+                client,
+                limiter,
+                model=OPENAI_API_MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": instructions + "\n".join(window_lines)}
+                ],
+                max_tokens=500,
+                temperature=0.5
+            )
+
+    # gather keeps the windows' order, which is timestamp order
+    return await asyncio.gather(*[complete(window_lines) for _, window_lines in windows])
+
+async def _map_windows_async(windows, system_prompt, instructions, concurrency):
+    client = new_async_openai_client()
+    try:
+        return await _complete_windows(client, windows, system_prompt, instructions, asyncio.Semaphore(max(1, concurrency)))
+    finally:
+        await client.close()
+
+def merge_answers(windows, answers):
+    if len(windows) == 1:
+        return answers[0]
+    return "\n\n".join(f"[{window.start_times()[0]} --> {window.end_times()[-1]}]\n{answer}"
+                       for (window, _), answer in zip(windows, answers))
+
+def map_windows(segments, lines, system_prompt, instructions, window_tokens=WINDOW_TOKENS, concurrency=CONCURRENCY):
+    # Map: one request per window, up to concurrency at a time. Reduce: the answers in timestamp order
+    windows = split_into_windows(segments, lines, window_tokens)
+    return merge_answers(windows, asyncio.run(_map_windows_async(windows, system_prompt, instructions, concurrency)))
+
+def analyze_emotions(segments, window_tokens=WINDOW_TOKENS, concurrency=CONCURRENCY):
+    lines = [f"{start}: {text}" for start, text in zip(segments.start_times(), segments.texts())]
+    instructions = (
         "Analyze the following text and identify emotional segments such as sadness, joy, fear, anger, and hope. "
         "Return only the emotional segments along with their corresponding emotions:\n\n"
-        f"{text}"
     )
-    client = OpenAI()
-    completion = client.chat.completions.create(
-        model=OPENAI_API_MODEL,
-        messages=[
-            {"role": "system", "content": "You are an expert emotion detector."},
-            {"role": "user", "content": prompt_text}
-        ],
-        max_tokens=500,
-        temperature=0.5
-    )
-    return completion.choices[0].message
-
-def analyze_questions(segments, question):
-    text = "\n".join([f"{seg['start_time']} --> {seg['end_time']}: {seg['text']}" for seg in segments])
-    # text = "\n".join([f"{seg['start_time']}: {seg['text']}" for seg in segments])
-    prompt_text = (
-       f"{question}"
-        f"{text}"
-    )
-    client = OpenAI()
-    completion = client.chat.completions.create(
-        model=OPENAI_API_MODEL,
-        messages=[
-            {"role": "system", "content": "You are an transcription expert"},
-            {"role": "user", "content": prompt_text}
-        ],
-        max_tokens=500,
-        temperature=0.5
-    )
-    ##print(completion.choices[0].message)
-    # print(completion.choices[0])
-    print(completion.choices[0].message.content)
-    # return completion.choices[0].message
+    return map_windows(segments, lines, "You are an expert emotion detector.", instructions, window_tokens,
+                       concurrency)
+
+def question_lines(segments):
+    return [f"{start} --> {end}: {text}"
+            for start, end, text in zip(segments.start_times(), segments.end_times(), segments.texts())]
+
+def analyze_questions(segments, question, window_tokens=WINDOW_TOKENS, concurrency=CONCURRENCY):
+    lines = question_lines(segments)
+    answer = map_windows(segments, lines, "You are an transcription expert", question, window_tokens, concurrency)
+    print(answer)
+    return answer
 
 # Function to generate an image using OpenAI API
 def generate_image_from_text(prompt_text, image_size="1024x1792"):
-    client = OpenAI()
+    client = openai_client()
+    cache = response_cache()
+    key = cache_key(kind="image", base_url=str(client.base_url), prompt=prompt_text, size=image_size)
+    if cache and (url := cache.get(key)) is not None:
+        return url
     response = client.images.generate(
-        api_key=OPENAI_API_KEY,
         prompt=prompt_text,
         n=1,
         size=image_size
     )
-    return response["data"][0]["url"]
+    url = response.data[0].url
+    if cache:
+        cache.put(key, url, ttl_seconds=IMAGE_URL_TTL)
+    return url
+
+def list_srt_files(srt_folder_path, number=None):
+    srt_files = sorted(os.path.join(srt_folder_path, f) for f in os.listdir(srt_folder_path) if f.endswith('.srt'))
+    return srt_files[:number] if number else srt_files
+
+def load_srt_files_to_segments(srt_folder_path, number=None, workers=None):
+    """
+    Yields a SubtitleTable for each of the first number transcripts in the folder, in file name order, with source
+    set to its path. Files are parsed in a process pool, only a few ahead of the one being used are kept in memory.
+    """
+    return load_srt_paths(list_srt_files(srt_folder_path, number), workers)
+
+def load_srt_paths(srt_files, workers=None):
+    workers = workers or min(len(srt_files), os.cpu_count() or 1)
+    if workers <= 1:
+        for srt_path in srt_files:
+            yield read_srt_file_segments(srt_path)
+        return
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for srt_path in srt_files:
+            pending.append(pool.submit(read_srt_file_segments, srt_path))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def update_transcript_index(srt_folder_path, number=None, index_dir=None, embedding="hashing"):
+    # Indexes the transcripts that are new or changed since the last run, the index lives next to them by default
+    from transcript_index import TranscriptIndex
+    index = TranscriptIndex(index_dir or os.path.join(srt_folder_path, ".transcript_index"), embedding)
+    srt_files = list_srt_files(srt_folder_path, number)
+    stale = [srt_path for srt_path in srt_files if not index.is_current(srt_path)]
+    passages = sum(index.add(segments.source, segments) for segments in load_srt_paths(stale))
+    index.compact_if_needed()
+    print(f"Indexed {len(stale)} new or changed of {len(srt_files)} transcripts ({passages} passages)")
+    return index, srt_files
+
+def answer_from_index(index, question, top_k=TOP_K, sources=None):
+    # Only the top_k passages closest to the question go to the model, from across the transcripts
+    from transcript_index import format_hits
+    hits = index.search(question, top_k, sources)
+    if not hits:
+        print("No transcript passages to answer from")
+        return None
+    answer = chat_completion(
+        model=OPENAI_API_MODEL,
+        messages=[
+            {"role": "system", "content": "You are an transcription expert"},
+            {"role": "user", "content": f"{question}\n\n{format_hits(hits)}"}
+        ],
+        max_tokens=500,
+        temperature=0.5
+    )
+    print(answer)
+    return answer
+
+async def _run_prompt_batch(srt_files, prompts, store, window_tokens, concurrency, requests_per_minute):
+    from prompt_batch import RateLimiter
+    client = new_async_openai_client()
+    requests = asyncio.Semaphore(max(1, concurrency))
+    # Transcripts being worked on at once, so a big archive isn't all in memory
+    transcripts = asyncio.Semaphore(max(1, concurrency))
+    limiter = RateLimiter(requests_per_minute)
+    failed = []
+
+    async def run_file(srt_path):
+        todo = [(n, prompt) for n, prompt in enumerate(prompts) if not store.has(srt_path, prompt, OPENAI_API_MODEL)]
+        if not todo:
+            return
+        async with transcripts:
+            segments = await asyncio.to_thread(read_srt_file_segments, srt_path)
+            windows = split_into_windows(segments, question_lines(segments), window_tokens)
+
+            async def run_prompt(n, prompt):
+                try:
+                    answers = await _complete_windows(client, windows, "You are an transcription expert", prompt,
+                                                      requests, limiter)
+                except Exception as e:
+                    print(f"{srt_path}: {e}")
+                    failed.append((srt_path, prompt))
+                    return
+                store.add(srt_path, prompt, OPENAI_API_MODEL, merge_answers(windows, answers))
+                print(f"{len(store.results)} answers: {os.path.basename(srt_path)}, prompt {n}")
+
+            await asyncio.gather(*[run_prompt(n, prompt) for n, prompt in todo])
 
-def load_srt_files_to_segments(srt_folder_path, number):
-    srt_files = [f for f in os.listdir(srt_folder_path) if f.endswith('.srt')]
-    if number:
-        srt_files = srt_files[0:number]
-    for srt_file in srt_files:
-        srt_path = os.path.join(srt_folder_path, srt_file)
-        segments = read_srt_file_segments(srt_path)
-        return segments
+    try:
+        await asyncio.gather(*[run_file(srt_path) for srt_path in srt_files])
+    finally:
+        await client.close()
+    return failed
+
+def run_prompt_batch(srt_folder_path, prompts, results_path, number=None, window_tokens=WINDOW_TOKENS,
+                     concurrency=CONCURRENCY, requests_per_minute=REQUESTS_PER_MINUTE):
+    """
+    Runs every prompt on every transcript in the folder without asking anything, concurrently and within
+    requests_per_minute. Answers go to the results_path JSONL as they finish, keyed by (file, prompt, model), and
+    what is already there is skipped, so a stopped batch is resumed by running it again. Returns the failures.
+    """
+    from prompt_batch import ResultStore
+    srt_files = [os.path.abspath(srt_path) for srt_path in list_srt_files(srt_folder_path, number)]
+    store = ResultStore(results_path)
+    done = sum(store.has(srt_path, prompt, OPENAI_API_MODEL) for srt_path in srt_files for prompt in prompts)
+    print(f"{len(srt_files)} transcripts x {len(prompts)} prompts, {done} already answered in {results_path}")
+    try:
+        failed = asyncio.run(_run_prompt_batch(srt_files, prompts, store, window_tokens, concurrency,
+                                               requests_per_minute))
+    finally:
+        store.close()
+    if failed:
+        print(f"{len(failed)} failed, run again to retry them")
+    return failed
 
 class Action(Enum):
     ALL = 'all'
@@ -110,6 +325,7 @@ class Action(Enum):
     INIT_GPT = 'init_gpt'
     EXTRACT_SCENE = 'extract_scene'
     ASK_QUESTION = 'ask_question'
+    BATCH_PROMPTS = 'batch_prompts'
 
 def main():
     parser = argparse.ArgumentParser(description='Process a mpeg file source and creates a project file with SRT and AUDIO assests')
@@ -118,6 +334,20 @@ def main():
     parser.add_argument('-l', '--model', type=str, default="srt_scenes_model_v1", help='GPT Model to load or init', required=False)
     parser.add_argument('-p', '--prompt', type=int, help='The prompt number to run', required=False)
     parser.add_argument('-n', '--number', type=int, help='Max number of transcripts to import', required=False, default=None)
+    parser.add_argument('--window_tokens', type=int, default=WINDOW_TOKENS, help='Transcript tokens per request, long transcripts are split into windows')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='Requests in flight at once')
+    parser.add_argument('--base_url', type=str, default=None, help='OpenAI compatible server to use instead, e.g. a local stub')
+    parser.add_argument('-q', '--question', type=str, default=None, help='With -a ask_question: answer it from the most relevant passages of all the transcripts')
+    parser.add_argument('--top_k', type=int, default=TOP_K, help='Passages retrieved per question')
+    parser.add_argument('--index_dir', type=str, default=None, help='Transcript index folder, default .transcript_index in the SRT folder')
+    parser.add_argument('--embedding', type=str, default="hashing", help='hashing (no model) or a local sentence-transformers model name')
+    parser.add_argument('--prompts_file', type=str, default=None, help='With -a batch_prompts: more prompts, a JSON list or text with prompts separated by --- lines')
+    parser.add_argument('--results', type=str, default=None, help='With -a batch_prompts: answers JSONL, default prompt_results.jsonl in the SRT folder')
+    parser.add_argument('--requests_per_minute', type=float, default=REQUESTS_PER_MINUTE, help='With -a batch_prompts: rate limit, 0 for none')
+    parser.add_argument('--cache', type=str, default=DEFAULT_CACHE_PATH, help='Response cache file, repeated prompts are answered from it')
+    parser.add_argument('--no_cache', action='store_true', help='Always ask the API')
+    parser.add_argument('--cache_max_mb', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Least recently used responses are dropped above this size')
+    parser.add_argument('--cache_ttl_hours', type=float, default=None, help='Responses older than this are asked again, default never')
 
 
 
@@ -127,10 +357,7 @@ def main():
 ## help command
 ## create question, create a function "I want to ask prompt 1" and run that prompt (ending with :question= )
 
-    prompts = [
-        "Can you identify when a question is asked in the script and what the answer is.\n\n"
-        "Format the output with timestamp\nQuestion: Answer: \n\n"
-    ]
+    prompts = list(PROMPTS)
     def print_prompts():
         for index, prompt in enumerate(prompts):
             print(f"{index}: {prompt}")
@@ -138,15 +365,19 @@ def main():
 
     ## input from user
     args = parser.parse_args()
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+    configure_cache(args.cache, args.cache_max_mb * 1024 * 1024,
+                    args.cache_ttl_hours * 3600 if args.cache_ttl_hours else None, enabled=not args.no_cache)
 
     # Note running twice will result
     if args.action in [Action.LOAD_SRT]:
         try:
             #run_open_ai_completion_as_role()
-            segments = load_srt_files_to_segments(args.folder, args.number)
-            emotional_segments = analyze_emotions(segments)
-            print("\nDetected Emotional Segments:\n")
-            pprint.pprint(emotional_segments.to_dict()['content'])
+            for segments in load_srt_files_to_segments(args.folder, args.number):
+                emotional_segments = analyze_emotions(segments, args.window_tokens, args.concurrency)
+                print(f"\nDetected Emotional Segments in {segments.source}:\n")
+                pprint.pprint(emotional_segments)
         except Exception as e:
             print(e)
 
@@ -160,20 +391,39 @@ def main():
     #     except Exception as e:
     #         print(f"Error during ASK_QUESTION: {e}")
 
-# If user inputs a prompt number, replace the question with the prompt number in the array
-    try:
-        askPrompts = input("choose a prompt number:")
-        print_prompts()
-
-        segments = load_srt_files_to_segments(args.folder, args.number)
-        qa_segments = analyze_questions(segments, prompts[int(askPrompts)])
-        print("\nQuestions and Answers Detected:\n")
-        # pprint.pprint(qa_segments)
-    except Exception as e:
-        import traceback
-        print(traceback.format_exc())
-        print(Exception, e)
-        print(f"Error during ASK_QUESTION: {e}")
+    if args.prompts_file:
+        from prompt_batch import read_prompts_file
+        prompts += read_prompts_file(args.prompts_file)
+
+    if args.action in [Action.BATCH_PROMPTS]:
+        failed = run_prompt_batch(args.folder, prompts, args.results or os.path.join(args.folder, "prompt_results.jsonl"),
+                                  args.number, args.window_tokens, args.concurrency, args.requests_per_minute)
+    elif args.action in [Action.ASK_QUESTION] and args.question:
+        index, srt_files = update_transcript_index(args.folder, args.number, args.index_dir, args.embedding)
+        answer_from_index(index, args.question, args.top_k, srt_files)
+    else:
+        # If user inputs a prompt number, replace the question with the prompt number in the array
+        try:
+            askPrompts = input("choose a prompt number:")
+            print_prompts()
+
+            for segments in load_srt_files_to_segments(args.folder, args.number):
+                print(f"\nQuestions and Answers Detected in {segments.source}:\n")
+                qa_segments = analyze_questions(segments, prompts[int(askPrompts)], args.window_tokens, args.concurrency)
+            # pprint.pprint(qa_segments)
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
+            print(Exception, e)
+            print(f"Error during ASK_QUESTION: {e}")
+
+    cache = response_cache()
+    if cache:
+        stats = cache.stats()
+        print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries "
+              f"({stats['bytes'] / 1024:.0f} KiB) in {cache.path}")
+    if args.action in [Action.BATCH_PROMPTS] and failed:
+        sys.exit(1)
 
 
 
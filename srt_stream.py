@@ -0,0 +1,74 @@
+import re
+from collections import namedtuple
+from typing import Iterable, Iterator, List, TextIO, Tuple
+
+# start and end are in seconds, text keeps the cue's lines joined with '\n'
+Cue = namedtuple('Cue', ['index', 'start', 'end', 'text'])
+
+TIME_LINE = re.compile(r'^\s*(\d+:\d{2}:\d{2}[,.]\d{3})\s*-->\s*(\d+:\d{2}:\d{2}[,.]\d{3})')
+
+
+def convert_srt_time_to_seconds(srt_time) -> float:
+    hours, minutes, seconds, milliseconds = map(float, re.split('[:,.]', srt_time))
+    return hours * 3600 + minutes * 60 + seconds + milliseconds/1000
+
+def convert_seconds_to_srt_time(seconds) -> str:
+    _hours, _milliseconds = divmod(round(seconds * 1000), 3_600_000)
+    _minutes, _milliseconds = divmod(_milliseconds, 60_000)
+    _seconds, _milliseconds = divmod(_milliseconds, 1000)
+    return f"{_hours:02}:{_minutes:02}:{_seconds:02},{_milliseconds:03}"
+
+
+def iter_cue_blocks(lines: Iterable[str]) -> Iterator[Tuple[str, str, str, List[str]]]:
+    """
+    Yields (index, start, end, text_lines) for each cue with the timestamps still as strings.
+    Works one line at a time, so memory stays flat however long the transcript is.
+    Handles a UTF-8 BOM, CRLF line endings, multi-line cues and cues without an index line.
+    """
+    index = None
+    times = None
+    text_lines = []
+    first = True
+    for line in lines:
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        line = line.rstrip('\r\n')
+        if times is None:
+            match = TIME_LINE.match(line)
+            if match:
+                times = match.groups()
+            elif line.strip():
+                index = line.strip()
+            continue
+        if line.strip():
+            text_lines.append(line)
+            continue
+        yield index, times[0], times[1], text_lines
+        index, times, text_lines = None, None, []
+    if times is not None:
+        yield index, times[0], times[1], text_lines
+
+
+def iter_cues(lines: Iterable[str]) -> Iterator[Cue]:
+    for index, start, end, text_lines in iter_cue_blocks(lines):
+        yield Cue(int(index) if index and index.isdigit() else None,
+                  convert_srt_time_to_seconds(start), convert_srt_time_to_seconds(end), '\n'.join(text_lines))
+
+
+def read_cues(file_path: str) -> Iterator[Cue]:
+    # utf-8-sig drops the BOM, universal newlines turn CRLF into \n
+    with open(file_path, 'r', encoding='utf-8-sig') as file:
+        yield from iter_cues(file)
+
+
+def format_cue(index: int, start: float, end: float, text: str) -> str:
+    return f"{index}\n{convert_seconds_to_srt_time(start)} --> {convert_seconds_to_srt_time(end)}\n{text}\n\n"
+
+
+def write_cues(file: TextIO, cues: Iterable[Cue], renumber=True) -> int:
+    # Writes cue by cue, returns the number of cues written
+    count = 0
+    for count, cue in enumerate(cues, start=1):
+        file.write(format_cue(count if renumber or cue.index is None else cue.index, cue.start, cue.end, cue.text))
+    return count
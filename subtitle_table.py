@@ -0,0 +1,137 @@
+from typing import Iterable, Iterator, List, Sequence
+
+import numpy as np
+
+from srt_stream import Cue, convert_srt_time_to_seconds, iter_cue_blocks
+
+# HH:MM:SS,mmm
+SRT_TIME_WIDTH = 12
+_DIGIT_COLUMNS = [0, 1, 3, 4, 6, 7, 9, 10, 11]
+
+
+def _parse_srt_times_one_by_one(times: Sequence[str]) -> np.ndarray:
+    return np.array([round(convert_srt_time_to_seconds(t) * 1000) for t in times], dtype=np.int64)
+
+
+def parse_srt_times(times: Sequence[str]) -> np.ndarray:
+    """
+    Converts SRT timestamps to milliseconds for the whole column at once.
+    The fixed width HH:MM:SS,mmm form is decoded as a byte matrix, anything else falls back to one at a time.
+    """
+    if not len(times):
+        return np.zeros(0, dtype=np.int64)
+    joined = ''.join(times)
+    # Every row must have the width, a short and a long one would add up to two of them
+    if not joined.isascii() or any(len(t) != SRT_TIME_WIDTH for t in times):
+        return _parse_srt_times_one_by_one(times)
+    chars = np.frombuffer(joined.encode('ascii'), dtype=np.uint8).reshape(-1, SRT_TIME_WIDTH)
+    if not ((chars[:, 2] == ord(':')) & (chars[:, 5] == ord(':')) & (chars[:, 8] == ord(','))).all() \
+            or ((chars[:, _DIGIT_COLUMNS] - ord('0')) > 9).any():
+        return _parse_srt_times_one_by_one(times)
+    digits = chars.astype(np.int64)
+    digits -= ord('0')
+    hours = digits[:, 0] * 10 + digits[:, 1]
+    minutes = digits[:, 3] * 10 + digits[:, 4]
+    seconds = digits[:, 6] * 10 + digits[:, 7]
+    milliseconds = digits[:, 9] * 100 + digits[:, 10] * 10 + digits[:, 11]
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + milliseconds
+
+
+def format_srt_times(milliseconds: np.ndarray) -> List[str]:
+    # Inverse of parse_srt_times, hours past 99 don't fit the fixed width and are formatted one at a time
+    milliseconds = np.asarray(milliseconds, dtype=np.int64)
+    if len(milliseconds) and milliseconds.max() >= 100 * 3_600_000:
+        return [f"{ms // 3_600_000:02}:{ms // 60_000 % 60:02}:{ms // 1000 % 60:02},{ms % 1000:03}"
+                for ms in milliseconds.tolist()]
+    hours, rest = np.divmod(milliseconds, 3_600_000)
+    minutes, rest = np.divmod(rest, 60_000)
+    seconds, ms = np.divmod(rest, 1000)
+    chars = np.empty((len(milliseconds), SRT_TIME_WIDTH), dtype=np.uint8)
+    chars[:, 2] = chars[:, 5] = ord(':')
+    chars[:, 8] = ord(',')
+    for column, value in zip(_DIGIT_COLUMNS, [hours // 10, hours % 10, minutes // 10, minutes % 10,
+                                              seconds // 10, seconds % 10, ms // 100, ms // 10 % 10, ms % 10]):
+        chars[:, column] = value + ord('0')
+    flat = chars.tobytes().decode('ascii')
+    return [flat[i:i + SRT_TIME_WIDTH] for i in range(0, len(flat), SRT_TIME_WIDTH)]
+
+
+class SubtitleTable:
+    """
+    Columnar subtitles: index, start_ms and end_ms are NumPy arrays, and all cue texts live in one string with
+    offsets[i]:offsets[i + 1] marking cue i. Much smaller than a dict or Cue per line, and filtering by time is
+    one vectorized mask.
+    """
+
+    __slots__ = ('index', 'start_ms', 'end_ms', 'text', 'offsets', 'source')
+
+    def __init__(self, index: np.ndarray, start_ms: np.ndarray, end_ms: np.ndarray, text: str, offsets: np.ndarray,
+                 source: str = None):
+        self.index = index
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.text = text
+        self.offsets = offsets
+        self.source = source
+
+    @classmethod
+    def from_texts(cls, index, start_ms, end_ms, texts: Sequence[str], source: str = None) -> 'SubtitleTable':
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in texts], out=offsets[1:])
+        return cls(np.asarray(index, dtype=np.int32), np.asarray(start_ms, dtype=np.int64),
+                   np.asarray(end_ms, dtype=np.int64), ''.join(texts), offsets, source)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str], source: str = None) -> 'SubtitleTable':
+        # Parses an srt one cue at a time, the timestamps are converted in one go at the end
+        indexes, starts, ends, texts = [], [], [], []
+        for position, (index, start, end, text_lines) in enumerate(iter_cue_blocks(lines), start=1):
+            indexes.append(int(index) if index and index.isdigit() else position)
+            starts.append(start.replace('.', ','))
+            ends.append(end.replace('.', ','))
+            # Multi-line cues become one line, the way the prompts want them
+            texts.append(' '.join(text_lines))
+        return cls.from_texts(indexes, parse_srt_times(starts), parse_srt_times(ends), texts, source)
+
+    @classmethod
+    def read_srt(cls, file_path: str) -> 'SubtitleTable':
+        with open(file_path, 'r', encoding='utf-8-sig') as file:
+            return cls.from_lines(file, source=file_path)
+
+    @classmethod
+    def from_cues(cls, cues: Iterable[Cue], source: str = None) -> 'SubtitleTable':
+        cues = list(cues)
+        return cls.from_texts([cue.index or i for i, cue in enumerate(cues, start=1)],
+                              [round(cue.start * 1000) for cue in cues], [round(cue.end * 1000) for cue in cues],
+                              [cue.text for cue in cues], source)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def text_at(self, i: int) -> str:
+        return self.text[self.offsets[i]:self.offsets[i + 1]]
+
+    def texts(self) -> List[str]:
+        offsets = self.offsets.tolist()
+        return [self.text[offsets[i]:offsets[i + 1]] for i in range(len(self))]
+
+    def take(self, selection) -> 'SubtitleTable':
+        # selection is a boolean mask or an array of row numbers
+        rows = np.flatnonzero(selection) if np.asarray(selection).dtype == bool else np.asarray(selection)
+        offsets = self.offsets.tolist()
+        texts = [self.text[offsets[i]:offsets[i + 1]] for i in rows.tolist()]
+        return SubtitleTable.from_texts(self.index[rows], self.start_ms[rows], self.end_ms[rows], texts, self.source)
+
+    def between(self, start_ms: int, end_ms: int) -> 'SubtitleTable':
+        # Cues overlapping [start_ms, end_ms)
+        return self.take((self.end_ms > start_ms) & (self.start_ms < end_ms))
+
+    def start_times(self) -> List[str]:
+        return format_srt_times(self.start_ms)
+
+    def end_times(self) -> List[str]:
+        return format_srt_times(self.end_ms)
+
+    def to_cues(self) -> Iterator[Cue]:
+        for i, start, end, text in zip(self.index.tolist(), self.start_ms.tolist(), self.end_ms.tolist(), self.texts()):
+            yield Cue(i, start / 1000, end / 1000, text)
@@ -0,0 +1,68 @@
+"""
+A small OpenAI compatible server for the tests, answering /v1/chat/completions the way --base_url points
+scene_summarizer at a stub. Each answer is the first line of the user message, so a test can tell which request
+it answers.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ChatCompletions(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        user = next(message['content'] for message in body['messages'] if message['role'] == 'user')
+        server = self.server
+        with server.lock:
+            server.requests.append(user)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delay(user))
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        answer = user.splitlines()[0]
+        response = json.dumps({
+            'id': f"chatcmpl-{len(server.requests)}", 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': answer}}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+class OpenAIStub:
+    """Runs the server on a free port, delay(user message) is how long it takes to answer."""
+
+    def __init__(self, delay=lambda user: 0.0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ChatCompletions)
+        self.server.requests = []
+        self.server.in_flight = self.server.max_in_flight = 0
+        self.server.lock = threading.Lock()
+        self.server.delay = delay
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def max_in_flight(self):
+        return self.server.max_in_flight
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,34 @@
+import unittest
+
+from chunked_transcribe import Chunk, stitch_chunks
+from srt_stream import Cue
+
+
+class StitchTest(unittest.TestCase):
+
+    def test_cues_stay_inside_their_chunk(self):
+        results = [
+            (Chunk(0.0, 10.0), [Cue(1, 1.0, 4.0, " Hello there"),
+                                Cue(2, 9.5, 12.0, " runs over the cut"),
+                                Cue(3, 10.5, 11.0, " past the end")], []),
+            (Chunk(10.0, 20.0), [Cue(1, 0.5, 3.0, " and carries on")], []),
+        ]
+        cues, segments = stitch_chunks(results)
+        self.assertEqual([(cue.start, cue.end, cue.text) for cue in cues], [
+            (1.0, 4.0, " Hello there"),
+            (9.5, 10.0, " runs over the cut"),
+            (10.5, 13.0, " and carries on"),
+        ])
+        self.assertEqual(len(segments), len(cues))
+
+    def test_repeat_at_the_cut_is_dropped(self):
+        results = [
+            (Chunk(0.0, 10.0), [Cue(1, 8.0, 9.8, " I remember the school")], []),
+            (Chunk(10.0, 20.0), [Cue(1, 0.0, 1.0, " I remember the school."), Cue(2, 1.0, 3.0, " It was cold")], []),
+        ]
+        cues, _ = stitch_chunks(results)
+        self.assertEqual([cue.text for cue in cues], [" I remember the school", " It was cold"])
+
+
+if __name__ == '__main__':
+    unittest.main()
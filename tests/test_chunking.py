@@ -0,0 +1,200 @@
+"""
+Golden outputs of the chunker as it was before the single pass engine (split_text_into_chunks and split_transcript
+at fe11313, which ignored max_words), pinned so the engine keeps the same boundaries and durations.
+Run from the repo root:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from srt_stream import iter_cues
+from whisper_output_splitter import chunk_words, resplit_cues, split_cues, split_text_into_chunks, split_transcript
+from word_timings import Word, WordSegment
+
+DURATION = 6.0
+
+# cue text -> [(chunk text, duration of a 6 second cue)] from the original chunker
+GOLDEN_CHUNKS = {
+    "And that's how small groups became, let's say, chat rooms in Pirețele and I was in all the chat rooms and if I "
+    "could, if I needed, I would bring them.": [
+        ("And that's how small groups became", 1.161),
+        ("Let's say chat rooms in Pirețele", 1.161),
+        ("And I was in all the chat rooms and if I could", 2.323),
+        ("If I needed I would bring them", 1.355),
+    ],
+    "Yes.": [
+        ("Yes", 6.0),
+    ],
+    "We were afraid, but we stayed in the city because my mother could not walk and the trains were full.": [
+        ("We were afraid", 0.9),
+        ("But we stayed in the city because my mother could not walk", 3.6),
+        ("And the trains were full", 1.5),
+    ],
+    "Where did you go? To the west, to Lviv.": [
+        ("Where did you go?", 2.667),
+        ("To the west to Lviv", 3.333),
+    ],
+    "Twenty-five people lived in one apartment - it was very cold | no heating.": [
+        ("Twenty five people lived in one apartment", 3.0),
+        ("It was very cold no heating", 2.571),
+    ],
+    "So we waited and waited for news from my brother, or from anyone who had seen him.": [
+        ("So we waited and waited", 1.765),
+        ("For news from my brother", 1.765),
+        ("Or from anyone who had seen him", 2.471),
+    ],
+}
+
+TRANSCRIPT = """1
+00:00:01,000 --> 00:00:07,500
+And that's how small groups became, let's say, chat rooms in Pirețele and I was in all the chat rooms and if I could, if I needed, I would bring them.
+
+2
+00:00:08,000 --> 00:00:09,000
+Yes.
+
+3
+00:01:02,250 --> 00:01:08,000
+We were afraid, but we stayed in the city
+because my mother could not walk and the trains were full.
+"""
+
+# split_transcript(TRANSCRIPT) at fe11313, which wrote times truncated to whole seconds
+GOLDEN_TRANSCRIPT = """1
+00:00:01,000 --> 00:00:02,000
+And that's how small groups became
+
+2
+00:00:02,000 --> 00:00:03,000
+Let's say chat rooms in Pirețele
+
+3
+00:00:03,000 --> 00:00:06,000
+And I was in all the chat rooms and if I could
+
+4
+00:00:06,000 --> 00:00:07,000
+If I needed I would bring them
+
+5
+00:00:08,000 --> 00:00:09,000
+Yes
+
+6
+00:01:02,000 --> 00:01:03,000
+We were afraid
+
+7
+00:01:03,000 --> 00:01:06,000
+But we stayed in the city because my mother could not walk
+
+8
+00:01:06,000 --> 00:01:08,000
+And the trains were full
+"""
+
+
+def rounded(chunks):
+    return [(text, round(duration, 3)) for text, duration in chunks]
+
+
+class GoldenChunkingTest(unittest.TestCase):
+
+    def test_chunks_match_original(self):
+        for text, expected in GOLDEN_CHUNKS.items():
+            with self.subTest(text=text):
+                self.assertEqual(rounded(split_text_into_chunks(text, DURATION)), expected)
+
+    def test_transcript_matches_original(self):
+        # Same cues and text, times compared the way the original wrote them
+        output = list(iter_cues(split_transcript(TRANSCRIPT, max_words=None).splitlines()))
+        golden = list(iter_cues(GOLDEN_TRANSCRIPT.splitlines()))
+        self.assertEqual([(cue.index, int(cue.start), int(cue.end), cue.text) for cue in output],
+                         [(cue.index, cue.start, cue.end, cue.text) for cue in golden])
+
+    def test_empty_chunk_is_dropped(self):
+        # The original raised IndexError on the first two and returned [('', 4.0)] for the last, which split_cues
+        # wrote as a blank cue
+        for text in ["- -", " ", " , "]:
+            with self.subTest(text=text):
+                self.assertEqual(split_text_into_chunks(text, DURATION), [])
+
+    def test_word_counts_per_chunk(self):
+        chunks, total_words = chunk_words("We were afraid, but we stayed in the city because my mother could not walk "
+                                          "and the trains were full.")
+        self.assertEqual(total_words, 20)
+        self.assertEqual([n_words for _, n_words in chunks], [3, 12, 5])
+
+    def test_no_blank_cues(self):
+        output = split_transcript("1\n00:00:01,000 --> 00:00:02,000\n , \n\n2\n00:00:02,000 --> 00:00:03,000\nYes.\n")
+        self.assertEqual([cue.text for cue in iter_cues(output.splitlines())], ["Yes"])
+
+
+class MaxWordsTest(unittest.TestCase):
+
+    def test_long_chunk_is_split_into_balanced_pieces(self):
+        text = "We were afraid, but we stayed in the city because my mother could not walk and the trains were full."
+        self.assertEqual(rounded(split_text_into_chunks(text, DURATION, max_words=7)), [
+            ("We were afraid", 0.9),
+            ("But we stayed in the city", 1.8),
+            ("Because my mother could not walk", 1.8),
+            ("And the trains were full", 1.5),
+        ])
+
+    def test_short_chunks_are_unchanged(self):
+        for text, expected in GOLDEN_CHUNKS.items():
+            if all(len(chunk.split()) <= 12 for chunk, _ in expected):
+                with self.subTest(text=text):
+                    self.assertEqual(rounded(split_text_into_chunks(text, DURATION, max_words=12)), expected)
+
+    def test_no_piece_is_longer_than_max_words(self):
+        for max_words in range(1, 8):
+            for text in GOLDEN_CHUNKS:
+                with self.subTest(text=text, max_words=max_words):
+                    chunks = split_text_into_chunks(text, DURATION, max_words=max_words)
+                    self.assertTrue(all(len(chunk.split()) <= max_words for chunk, _ in chunks))
+                    self.assertAlmostEqual(sum(duration for _, duration in chunks),
+                                           sum(duration for _, duration in split_text_into_chunks(text, DURATION)))
+
+    def test_every_piece_starts_with_a_capital(self):
+        # Pieces after the first of a max_words split are cues too, the original capitalized only the chunk
+        text = ("I remember the morning when the soldiers came to the village and my father told us to hide in "
+                "the cellar.")
+        self.assertEqual(rounded(split_text_into_chunks(text, DURATION, max_words=5)), [
+            ("I remember the morning", 1.143),
+            ("When the soldiers came", 1.143),
+            ("To the village", 0.857),
+            ("And my father told us", 1.429),
+            ("To hide in the cellar", 1.429),
+        ])
+
+    def test_cue_times_are_split_too(self):
+        cue = list(iter_cues(TRANSCRIPT.splitlines()))[2]
+        split = [(text, round(start, 2), round(end, 2)) for _, start, end, text in split_cues([cue], max_words=7)]
+        self.assertEqual(split, [
+            ("We were afraid", 62.25, 63.11),
+            ("But we stayed in the city", 63.11, 64.84),
+            ("Because my mother could not walk", 64.84, 66.56),
+            ("And the trains were full", 66.56, 68.0),
+        ])
+
+
+class ResplitTest(unittest.TestCase):
+
+    def test_cues_are_timed_by_their_words(self):
+        # Hyphens, '1,000' and a lone ' - ' are split or dropped by the chunker, the cues must not drift off their words
+        text = " Twenty-five people lived in one apartment - it cost 1,000 dollars a month, so we had no heating at all."
+        words = [Word(i * 1000, i * 1000 + 900, f" {word}") for i, word in enumerate(text.split())]
+        cues = [(chunk, start, end) for _, start, end, chunk in resplit_cues([WordSegment(0, 19900, words)], max_words=4)]
+        self.assertEqual(cues, [
+            ("Twenty five people lived", 0.0, 2.9),
+            ("In one apartment", 3.0, 5.9),
+            ("It cost 1", 6.0, 9.9),
+            ("000 dollars a month", 10.0, 12.9),
+            ("So we had no", 13.0, 16.9),
+            ("Heating at all", 17.0, 19.9),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""
+batch_list_comments and iter_comments against a small local stand-in for Drive's batch endpoint, the way
+--api_endpoint and --no_auth point the script at a fake.
+"""
+import email
+import email.policy
+import json
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import httplib2
+from googleapiclient.discovery import build
+
+import google_dump_comments
+from google_dump_comments import MAX_BATCH_SIZE, RETRIES, batch_list_comments, drive_batch_uri, iter_comments
+
+# file ID -> its comment pages
+PAGES = {
+    'single': [['s1']],
+    'paged': [['p1', 'p2'], ['p3'], ['p4']],
+    'limited': [['l1']],
+    'denied': [['d1']],
+}
+# Refused once with a rate limit 403, then served
+RATE_LIMITED_ONCE = {'limited'}
+# Refused with a 403 that is not a rate limit
+DENIED = {'denied'}
+# Rate limited on every try
+THROTTLED = {'throttled'}
+
+
+def comment_pages(file_id: str) -> list:
+    return PAGES.get(file_id, [[f"{file_id}-c"]])
+
+
+class FakeDrive(BaseHTTPRequestHandler):
+    """Drive's /batch/drive/v3 endpoint, enough for comments().list. The server keeps the parts of every batch."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        message = email.message_from_bytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body,
+                                           policy=email.policy.compat32)
+        parts = message.get_payload()
+        self.server.batches.append(len(parts))
+        if len(parts) > MAX_BATCH_SIZE:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({'error': {'code': 400, 'message': 'Too many requests in a batch'}}).encode())
+            return
+        boundary = 'fake_drive_boundary'
+        out = []
+        for part in parts:
+            request_line = part.get_payload().lstrip().split('\n', 1)[0]
+            status, payload = self.comments(urlparse(request_line.split(' ')[1]))
+            out.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                       f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                       f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n")
+        response = (''.join(out) + f"--{boundary}--\r\n").encode()
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/mixed; boundary={boundary}')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def comments(self, url):
+        # GET .../files/<id>/comments?pageToken=<n>
+        file_id = url.path.split('/files/')[1].split('/')[0]
+        with self.server.lock:
+            self.server.calls.append(file_id)
+            first_try = file_id in RATE_LIMITED_ONCE and file_id not in self.server.refused
+            if first_try:
+                self.server.refused.add(file_id)
+        if first_try:
+            return '403 Forbidden', {'error': {'code': 403, 'message': 'Rate Limit Exceeded',
+                                               'errors': [{'reason': 'rateLimitExceeded'}]}}
+        if file_id in THROTTLED:
+            return '403 Forbidden', {'error': {'code': 403, 'message': 'Rate Limit Exceeded',
+                                               'errors': [{'reason': 'userRateLimitExceeded'}]}}
+        if file_id in DENIED:
+            return '403 Forbidden', {'error': {'code': 403, 'message': 'Forbidden',
+                                               'errors': [{'reason': 'insufficientFilePermissions'}]}}
+        pages = comment_pages(file_id)
+        page = int(parse_qs(url.query).get('pageToken', ['0'])[0])
+        response = {'comments': [{'id': text, 'content': text} for text in pages[page]]}
+        if page + 1 < len(pages):
+            response['nextPageToken'] = str(page + 1)
+        return '200 OK', response
+
+
+class BatchCommentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeDrive)
+        self.server.batches, self.server.calls, self.server.refused = [], [], set()
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.api_endpoint = f"http://127.0.0.1:{self.server.server_port}/drive/v3/"
+        self.batch_uri = drive_batch_uri(self.api_endpoint)
+        # The rate limit backoff, not waited for here
+        sleep = mock.patch.object(google_dump_comments.time, 'sleep')
+        self.sleeps = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def make_service(self):
+        return build('drive', 'v3', http=httplib2.Http(), client_options={'api_endpoint': self.api_endpoint})
+
+    def test_pages_follow_across_rounds(self):
+        comments = batch_list_comments(self.make_service(), ['single', 'paged'], self.batch_uri)
+        self.assertEqual([c['content'] for c in comments['paged']], ['p1', 'p2', 'p3', 'p4'])
+        self.assertEqual([c['content'] for c in comments['single']], ['s1'])
+        # One batch per round, only the files that still have pages are asked again
+        self.assertEqual(self.server.batches, [2, 1, 1])
+
+    def test_rate_limit_is_retried_other_403_skipped(self):
+        comments = batch_list_comments(self.make_service(), ['limited', 'denied', 'single'], self.batch_uri)
+        self.assertEqual([c['content'] for c in comments['limited']], ['l1'])
+        self.assertEqual(comments['denied'], [])
+        self.assertEqual(self.server.batches, [3, 1])
+        self.assertEqual(self.server.calls.count('denied'), 1)
+        self.sleeps.assert_called_once_with(2)
+
+    def test_rate_limited_after_every_retry_is_skipped(self):
+        comments = batch_list_comments(self.make_service(), ['throttled', 'paged'], self.batch_uri)
+        self.assertEqual(comments['throttled'], [])
+        self.assertEqual(len(comments['paged']), 4)
+        self.assertEqual(self.server.calls.count('throttled'), RETRIES + 1)
+
+    def test_iter_comments_stays_within_the_batch_cap(self):
+        files = {f"name{i}": {'id': f"id{i}"} for i in range(2 * MAX_BATCH_SIZE + 50)}
+        files['paged file'] = {'id': 'paged'}
+        results = dict(iter_comments(self.make_service, files, workers=3, batch_size=MAX_BATCH_SIZE,
+                                     batch_uri=self.batch_uri))
+        self.assertEqual(set(results), set(files))
+        self.assertEqual([c['content'] for c in results['name7']], ['id7-c'])
+        self.assertEqual(len(results['paged file']), 4)
+        self.assertLessEqual(max(self.server.batches), MAX_BATCH_SIZE)
+        self.assertEqual(sum(self.server.batches), len(files) + 2)
+
+    def test_batch_size_over_the_cap_is_refused(self):
+        with mock.patch.object(sys, 'argv', ['google_dump_comments.py', '--no_auth', '--batch_size',
+                                             str(MAX_BATCH_SIZE + 1)]), \
+                mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+            google_dump_comments.main()
+        self.assertEqual(self.server.batches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
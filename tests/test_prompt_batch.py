@@ -0,0 +1,80 @@
+"""
+run_prompt_batch against a local OpenAI compatible stub (tests/openai_stub.py): every prompt on every transcript,
+resumed from the results file, and cached answers not held back by the rate limit.
+"""
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import scene_summarizer
+from openai_stub import OpenAIStub
+from scene_summarizer import configure_cache, run_prompt_batch
+
+PROMPTS = ["Prompt A\n\n", "Prompt B\n\n"]
+SRT = "1\n00:00:01,000 --> 00:00:02,500\nWhere did you grow up?\n\n2\n00:00:03,000 --> 00:00:05,000\nIn {city}.\n\n"
+
+
+class PromptBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = OpenAIStub()
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        self.srt_folder = os.path.join(self.folder, 'srt')
+        os.makedirs(self.srt_folder)
+        for name, city in (("a.srt", "Kyiv"), ("b.srt", "Lviv")):
+            with open(os.path.join(self.srt_folder, name), 'w', encoding='utf-8') as f:
+                f.write(SRT.format(city=city))
+        for patch in (mock.patch.dict(os.environ, {'OPENAI_BASE_URL': self.stub.base_url, 'OPENAI_API_KEY': 'test'}),
+                      mock.patch.object(scene_summarizer, 'OPENAI_API_MODEL', 'stub-model'),
+                      mock.patch.object(scene_summarizer, '_cache', None),
+                      mock.patch.object(scene_summarizer, '_cache_disabled', False)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        configure_cache(path=os.path.join(self.folder, 'llm_cache.sqlite'))
+        self.addCleanup(configure_cache, enabled=False)
+
+    def run_batch(self, results_name, requests_per_minute=0):
+        results_path = os.path.join(self.folder, results_name)
+        failed = run_prompt_batch(self.srt_folder, PROMPTS, results_path, requests_per_minute=requests_per_minute)
+        self.assertEqual(failed, [])
+        with open(results_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_every_prompt_on_every_transcript_then_resumed(self):
+        records = self.run_batch('results.jsonl')
+        self.assertEqual(sorted((os.path.basename(r['file']), r['prompt'], r['answer']) for r in records), [
+            ("a.srt", "Prompt A\n\n", "Prompt A"), ("a.srt", "Prompt B\n\n", "Prompt B"),
+            ("b.srt", "Prompt A\n\n", "Prompt A"), ("b.srt", "Prompt B\n\n", "Prompt B"),
+        ])
+        self.assertEqual(len(self.stub.requests), 4)
+        # Everything is in the results file, nothing is asked again
+        self.assertEqual(len(self.run_batch('results.jsonl')), 4)
+        self.assertEqual(len(self.stub.requests), 4)
+
+    def test_cache_hits_are_not_rate_limited(self):
+        self.run_batch('first.jsonl')
+        requests = len(self.stub.requests)
+        # One request a minute, a second cached answer would wait for a minute if hits were throttled
+        start = time.monotonic()
+        self.assertEqual(len(self.run_batch('second.jsonl', requests_per_minute=1)), 4)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(len(self.stub.requests), requests)
+
+    def test_requests_are_rate_limited(self):
+        configure_cache(enabled=False)
+        start = time.monotonic()
+        self.run_batch('results.jsonl', requests_per_minute=600)
+        self.assertEqual(len(self.stub.requests), 4)
+        # 0.1 seconds apart
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
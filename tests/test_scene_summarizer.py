@@ -0,0 +1,55 @@
+"""
+The windowed map-reduce against a local OpenAI compatible stub (tests/openai_stub.py), the way --base_url runs it.
+"""
+import os
+import unittest
+from unittest import mock
+
+import scene_summarizer
+from openai_stub import OpenAIStub
+from scene_summarizer import map_windows, split_into_windows
+from subtitle_table import SubtitleTable
+
+WINDOWS = 6
+
+
+class MapWindowsTest(unittest.TestCase):
+
+    def setUp(self):
+        # Later windows answer first, so the reduce has to put them back in order
+        self.stub = OpenAIStub(delay=lambda user: 0.05 * (WINDOWS - int(user.split()[1])))
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+        for patch in (mock.patch.dict(os.environ, {'OPENAI_BASE_URL': self.stub.base_url, 'OPENAI_API_KEY': 'test'}),
+                      mock.patch.object(scene_summarizer, 'OPENAI_API_MODEL', 'stub-model'),
+                      mock.patch.object(scene_summarizer, '_cache', None),
+                      mock.patch.object(scene_summarizer, '_cache_disabled', True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.segments = SubtitleTable.from_texts(range(1, WINDOWS + 1), [i * 2000 for i in range(WINDOWS)],
+                                                 [i * 2000 + 1500 for i in range(WINDOWS)],
+                                                 [f"window {i} text" for i in range(WINDOWS)])
+        self.lines = self.segments.texts()
+
+    def test_answers_come_back_in_window_order(self):
+        # A window token budget this small puts every line in a window of its own
+        windows = split_into_windows(self.segments, self.lines, window_tokens=1)
+        self.assertEqual(len(windows), WINDOWS)
+        answer = map_windows(self.segments, self.lines, "You are a test", "", window_tokens=1, concurrency=2)
+        self.assertEqual(answer, "\n\n".join(
+            f"[{start} --> {end}]\nwindow {i} text"
+            for i, (start, end) in enumerate(zip(self.segments.start_times(), self.segments.end_times()))))
+        self.assertEqual(sorted(self.stub.requests), sorted(self.lines))
+
+    def test_concurrency_limit(self):
+        map_windows(self.segments, self.lines, "You are a test", "", window_tokens=1, concurrency=2)
+        self.assertEqual(self.stub.max_in_flight, 2)
+
+    def test_one_window_is_answered_as_is(self):
+        answer = map_windows(self.segments, self.lines, "You are a test", "", concurrency=2)
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(answer, "window 0 text")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from subtitle_table import SubtitleTable, format_srt_times, parse_srt_times
+
+
+class ParseSrtTimesTest(unittest.TestCase):
+
+    def test_fixed_width(self):
+        self.assertEqual(parse_srt_times(['00:00:01,500', '01:02:03,004']).tolist(), [1500, 3723004])
+
+    def test_mixed_widths_fall_back(self):
+        # 11 + 13 characters are two rows' worth, they must not be decoded as a matrix
+        self.assertEqual(parse_srt_times(['1:00:00,000', '100:00:00,000']).tolist(), [3_600_000, 360_000_000])
+
+    def test_other_separators_fall_back(self):
+        self.assertEqual(parse_srt_times(['00:00:01.500', '00:00:02,000']).tolist(), [1500, 2000])
+
+    def test_format_round_trips(self):
+        times = ['00:00:00,000', '00:59:59,999', '12:34:56,789']
+        self.assertEqual(format_srt_times(parse_srt_times(times)), times)
+
+
+class SubtitleTableTest(unittest.TestCase):
+
+    def test_from_lines(self):
+        table = SubtitleTable.from_lines("1\n00:00:01,000 --> 00:00:02,500\nHello\nthere\n\n"
+                                         "2\n1:00:00,000 --> 100:00:00,000\nLong\n".splitlines())
+        self.assertEqual(table.start_ms.tolist(), [1000, 3_600_000])
+        self.assertEqual(table.end_ms.tolist(), [2500, 360_000_000])
+        self.assertEqual(table.texts(), ["Hello there", "Long"])
+        self.assertEqual(table.between(0, 2000).texts(), ["Hello there"])
+
+
+if __name__ == '__main__':
+    unittest.main()
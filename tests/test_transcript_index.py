@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from transcript_index import OFFSETS_FILE, PASSAGES_FILE, VECTORS_FILE, TranscriptIndex
+
+TOPICS = {
+    "school.srt": ["I went to school in Kharkiv", "the teachers were strict but kind", "we walked to school in snow"],
+    "farm.srt": ["my grandfather kept bees on the farm", "we picked cherries every summer", "the farm had two cows"],
+    "war.srt": ["the sirens started at night", "we slept in the metro station", "my brother joined the army"],
+}
+QUESTIONS = ["where did you go to school", "tell me about the farm", "what happened at night", "cherries and bees"]
+
+
+def write_srt(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, line in enumerate(lines):
+            # Long enough that every cue is a passage of its own
+            f.write(f"{i + 1}\n00:00:{i * 5:02},000 --> 00:00:{i * 5 + 4:02},000\n{' '.join([line] * 12)}\n\n")
+
+
+class CompactTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.srt_paths = []
+        for name, lines in TOPICS.items():
+            self.srt_paths.append(os.path.join(folder.name, name))
+            write_srt(self.srt_paths[-1], lines)
+        self.index_dir = os.path.join(folder.name, 'index')
+
+    def results(self, index):
+        return [[(hit.source, hit.start_ms, hit.end_ms, hit.text, round(hit.score, 5)) for hit in index.search(q, k=3)]
+                for q in QUESTIONS]
+
+    def test_compact_keeps_the_results_and_drops_the_old_generation(self):
+        index = TranscriptIndex(self.index_dir)
+        self.assertEqual(index.update(self.srt_paths), 9)
+        # One transcript changes, its old rows are dead but too few to compact on their own
+        write_srt(self.srt_paths[0], TOPICS["school.srt"][:2] + ["the school burned down in the war"])
+        self.assertEqual(index.update(self.srt_paths), 3)
+        self.assertEqual(index.dead_rows(), 3)
+        self.assertEqual(index.meta['generation'], 0)
+        before = self.results(index)
+        self.assertIn("burned down", before[0][0][3] + before[0][1][3] + before[0][2][3])
+
+        index.compact()
+        self.assertEqual((index.meta['rows'], index.dead_rows(), index.meta['generation']), (9, 0, 1))
+        self.assertEqual(self.results(index), before)
+        files = sorted(os.listdir(self.index_dir))
+        self.assertEqual(files, sorted(['index.json', 'vectors.1.f32', 'passages.1.jsonl', 'offsets.1.i64']))
+        for name in (VECTORS_FILE, PASSAGES_FILE, OFFSETS_FILE):
+            self.assertNotIn(name, files)
+
+        reopened = TranscriptIndex(self.index_dir)
+        self.assertEqual(self.results(reopened), before)
+        # Still appends to the new generation
+        self.assertEqual(reopened.update(self.srt_paths), 0)
+        write_srt(self.srt_paths[1], TOPICS["farm.srt"] + ["the bees swarmed in the orchard"])
+        self.assertEqual(reopened.update(self.srt_paths), 4)
+        self.assertTrue(reopened.search("bees swarmed orchard", k=1)[0].text.startswith("the bees swarmed"))
+
+    def test_update_compacts_once_enough_rows_are_dead(self):
+        index = TranscriptIndex(self.index_dir)
+        index.update(self.srt_paths)
+        for path in self.srt_paths[:2]:
+            write_srt(path, ["everything in this interview was rewritten after the edit"] + TOPICS[os.path.basename(path)])
+        index.update(self.srt_paths)
+        # 6 of 17 rows dead is over COMPACT_DEAD_FRACTION, update compacted them away
+        self.assertEqual((index.meta['rows'], index.dead_rows(), index.meta['generation']), (11, 0, 1))
+        self.assertEqual(len(TranscriptIndex(self.index_dir).search("everything in this interview was rewritten", k=20)), 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
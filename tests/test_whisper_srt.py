@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+import whisper_srt
+from whisper_srt import SAMPLE_RATE, checkpoint_path, find_audio_files, is_up_to_date, srt_path_for, \
+    transcribe_to_srt
+
+Segment = namedtuple('Segment', ['start', 'end', 'text'])
+
+
+class Interrupted(Exception):
+    pass
+
+
+class StubModel:
+    """Stands in for WhisperModel, yields segments (times relative to the audio it gets) and can fail part way."""
+
+    def __init__(self, segments, fail_after=None):
+        self.segments = segments
+        self.fail_after = fail_after
+        self.calls = []
+
+    def transcribe(self, audio, **kwargs):
+        self.calls.append((len(audio), kwargs.get('initial_prompt')))
+
+        def generate():
+            for n, segment in enumerate(self.segments):
+                if n == self.fail_after:
+                    raise Interrupted()
+                yield segment
+        return generate(), None
+
+
+class StubBar:
+    def update(self, n):
+        pass
+
+
+class FindAudioFilesTest(unittest.TestCase):
+
+    def test_one_file_per_srt_preferring_the_audio(self):
+        with tempfile.TemporaryDirectory() as folder:
+            # A splitter project folder: the video and the wav extracted from it, plus a video on its own
+            for name in ("X.mp4", "X.wav", "Y.mov", "notes.txt"):
+                open(os.path.join(folder, name), 'w').close()
+            files = find_audio_files([folder])
+        self.assertEqual([os.path.basename(path) for path in files], ["X.wav", "Y.mov"])
+        self.assertEqual(len({srt_path_for(path) for path in files}), len(files))
+
+    def test_explicit_duplicates_are_dropped(self):
+        with tempfile.TemporaryDirectory() as folder:
+            wav = os.path.join(folder, "X.wav")
+            mp4 = os.path.join(folder, "X.mp4")
+            for path in (wav, mp4):
+                open(path, 'w').close()
+            self.assertEqual(find_audio_files([mp4, wav, wav]), [wav])
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.audio_path = os.path.join(folder.name, "X.wav")
+        open(self.audio_path, 'w').close()
+        self.srt_path = srt_path_for(self.audio_path)
+        # 30 seconds of audio, only its length and slicing are used
+        decode = mock.patch.object(whisper_srt.faster_whisper, 'decode_audio', return_value=range(30 * SAMPLE_RATE))
+        decode.start()
+        self.addCleanup(decode.stop)
+
+    def read_srt(self):
+        with open(self.srt_path, encoding='UTF-8') as f:
+            return f.read()
+
+    def test_crash_before_the_first_cue_is_not_up_to_date(self):
+        with self.assertRaises(Interrupted):
+            transcribe_to_srt(StubModel([Segment(0.0, 1.0, " Hi")], fail_after=0), self.audio_path, self.srt_path,
+                              pbar=StubBar())
+        self.assertTrue(os.path.exists(checkpoint_path(self.srt_path)))
+        self.assertFalse(is_up_to_date(self.audio_path, self.srt_path))
+
+    def test_resume_after_an_interrupted_run(self):
+        first = [Segment(0.0, 2.0, " One"), Segment(2.0, 5.5, " Two"), Segment(5.5, 8.0, " Three")]
+        with self.assertRaises(Interrupted):
+            transcribe_to_srt(StubModel(first, fail_after=2), self.audio_path, self.srt_path, pbar=StubBar())
+        self.assertFalse(is_up_to_date(self.audio_path, self.srt_path))
+        written = self.read_srt()
+        self.assertEqual(written, "1\n00:00:00,000 --> 00:00:02,000\nOne\n\n2\n00:00:02,000 --> 00:00:05,500\nTwo\n\n")
+        # Half a cue written after the last checkpoint, it has to be cut off
+        with open(self.srt_path, 'a', encoding='UTF-8') as f:
+            f.write("3\n00:00:05,500 --> 00:")
+
+        # Times are relative to the audio from where the first run got to
+        second = StubModel([Segment(0.0, 2.5, " Three"), Segment(2.5, 4.0, " Four")])
+        transcribe_to_srt(second, self.audio_path, self.srt_path, pbar=StubBar())
+        self.assertEqual(second.calls, [(round((30 - 5.5) * SAMPLE_RATE), "Two")])
+        self.assertEqual(self.read_srt(), written + "3\n00:00:05,500 --> 00:00:08,000\nThree\n\n"
+                                                    "4\n00:00:08,000 --> 00:00:09,500\nFour\n\n")
+        self.assertFalse(os.path.exists(checkpoint_path(self.srt_path)))
+        self.assertTrue(is_up_to_date(self.audio_path, self.srt_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from work_queue import WorkQueue
+
+# Short leases so a stale one is seen within the test, the heartbeat runs every quarter of it
+LEASE = 0.2
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.queue_dir = folder.name
+
+    def worker(self) -> WorkQueue:
+        queue = WorkQueue(self.queue_dir, LEASE)
+        self.addCleanup(queue.stop_heartbeat)
+        return queue
+
+    def lease_path(self, job_id: str) -> str:
+        return os.path.join(self.queue_dir, f"{job_id}.lease")
+
+    def wait_until_stale(self, *queues: WorkQueue, job_id: str = 'job'):
+        # A lease is stale once a worker has seen it unchanged for longer than the lease
+        for queue in queues:
+            self.assertFalse(queue.claim(job_id))
+        time.sleep(LEASE * 1.5)
+
+    def test_claim_is_exclusive(self):
+        a, b = self.worker(), self.worker()
+        self.assertTrue(a.claim('job'))
+        self.assertFalse(b.claim('job'))
+        self.assertTrue(a.holds('job'))
+        self.assertFalse(b.holds('job'))
+        a.complete('job')
+        self.assertTrue(b.is_finished('job'))
+        self.assertFalse(b.claim('job'))
+        self.assertFalse(os.path.exists(self.lease_path('job')))
+
+    def test_failed_job_is_not_claimed_until_retried(self):
+        a, b = self.worker(), self.worker()
+        self.assertTrue(a.claim('job'))
+        a.fail('job', 'boom')
+        self.assertFalse(b.claim('job'))
+        b.retry_failed()
+        self.assertTrue(b.claim('job'))
+
+    def test_stale_lease_is_reclaimed(self):
+        a, b = self.worker(), self.worker()
+        self.assertTrue(a.claim('job'))
+        self.wait_until_stale(b)
+        self.assertTrue(b.claim('job'))
+        self.assertTrue(b.holds('job'))
+        self.assertFalse(a.holds('job'))
+
+    def test_late_reclaim_puts_the_new_lease_back(self):
+        a, b, c = self.worker(), self.worker(), self.worker()
+        self.assertTrue(a.claim('job'))
+        self.wait_until_stale(b, c)
+        # Both see the dead lease as stale, b reclaims and claims it before c gets to its rename
+        self.assertTrue(c._is_stale('job', self.lease_path('job')))
+        self.assertTrue(b.claim('job'))
+        self.assertFalse(c._reclaim('job', self.lease_path('job')))
+        self.assertTrue(b.owns('job'))
+        self.assertFalse(c.claim('job'))
+        self.assertEqual([name for name in os.listdir(self.queue_dir) if '.stale.' in name], [])
+
+    def test_racing_reclaims_have_one_winner(self):
+        for n in range(5):
+            job_id = f"job{n}"
+            dead = self.worker()
+            self.assertTrue(dead.claim(job_id))
+            racers = [self.worker() for _ in range(4)]
+            self.wait_until_stale(*racers, job_id=job_id)
+            start = threading.Barrier(len(racers))
+            won = [False] * len(racers)
+
+            def race(i):
+                start.wait()
+                won[i] = racers[i].claim(job_id)
+
+            threads = [threading.Thread(target=race, args=(i,)) for i in range(len(racers))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(sum(won), 1)
+            self.assertTrue(racers[won.index(True)].owns(job_id))
+
+    def test_heartbeat_keeps_the_lease(self):
+        a, b = self.worker(), self.worker()
+        self.assertTrue(a.claim('job'))
+        a.start_heartbeat()
+        deadline = time.monotonic() + LEASE * 4
+        while time.monotonic() < deadline:
+            self.assertFalse(b.claim('job'))
+            time.sleep(LEASE / 10)
+        self.assertTrue(a.holds('job'))
+
+    def test_on_lost_fires_when_the_lease_is_taken(self):
+        a, b = self.worker(), self.worker()
+        self.assertTrue(a.claim('job'))
+        # a's heartbeat is late, e.g. the host was suspended, and b takes the job over meanwhile
+        self.wait_until_stale(b)
+        self.assertTrue(b.claim('job'))
+        lost = []
+        fired = threading.Event()
+        a.start_heartbeat(on_lost=lambda job_id: (lost.append(job_id), fired.set()))
+        self.assertTrue(fired.wait(LEASE * 4))
+        self.assertEqual(lost, ['job'])
+        self.assertFalse(a.holds('job'))
+        # The heartbeat doesn't touch the lease it lost
+        self.assertTrue(b.owns('job'))
+
+
+if __name__ == '__main__':
+    unittest.main()
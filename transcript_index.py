@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import re
+import zlib
+from collections import namedtuple
+from typing import Callable, Iterable, List, Sequence
+
+import numpy as np
+
+from subtitle_table import SubtitleTable, format_srt_times
+
+# A retrieved passage, times in milliseconds
+Hit = namedtuple('Hit', ['score', 'source', 'start_ms', 'end_ms', 'text'])
+
+HASHING_DIM = 1024
+# Cues are short, consecutive cues are indexed together as passages of about this many words
+PASSAGE_WORDS = 60
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+VECTORS_FILE = 'vectors.f32'
+PASSAGES_FILE = 'passages.jsonl'
+OFFSETS_FILE = 'offsets.i64'
+META_FILE = 'index.json'
+# Rows of changed transcripts are dead, the live rows are rewritten once this share of all rows is dead
+COMPACT_DEAD_FRACTION = 0.3
+
+
+def hashing_embedding(texts: Sequence[str], dim: int = HASHING_DIM) -> np.ndarray:
+    """
+    Local embedding with no model: words and word pairs hashed into dim signed buckets, L2 normalized.
+    Finds passages sharing the question's words, a sentence-transformers model also finds paraphrases.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = TOKEN_PATTERN.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            h = zlib.crc32(feature.encode('utf-8'))
+            vectors[row, h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def sentence_transformer_embedding(model_name: str) -> Callable[[Sequence[str]], np.ndarray]:
+    # Optional, needs the sentence-transformers package and the model available locally
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name)
+    return lambda texts: model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def get_embedding(name: str) -> Callable[[Sequence[str]], np.ndarray]:
+    return hashing_embedding if name == 'hashing' else sentence_transformer_embedding(name)
+
+
+def passages(segments: SubtitleTable, passage_words: int = PASSAGE_WORDS):
+    # (start_ms, end_ms, text) of consecutive cues adding up to about passage_words words
+    texts = segments.texts()
+    first, words = 0, 0
+    for i, text in enumerate(texts):
+        words += len(text.split())
+        if words >= passage_words or i == len(texts) - 1:
+            yield int(segments.start_ms[first]), int(segments.end_ms[i]), ' '.join(t.strip() for t in texts[first:i + 1])
+            first, words = i + 1, 0
+
+
+class TranscriptIndex:
+    """
+    On-disk vector index of transcript passages in index_dir:
+
+    vectors.f32     one float32 row per passage, appended, read back as a memory map
+    passages.jsonl  one line per row: source, start_ms, end_ms, text
+    offsets.i64     byte offset of each row's line, so hits are read without scanning passages.jsonl
+    index.json      the embedding used, its dimension, and per transcript its size, mtime, content hash and rows
+
+    update() only embeds transcripts whose content is new or changed since they were indexed. A changed transcript's
+    old rows stay in the files but are no longer searched, until they add up to COMPACT_DEAD_FRACTION of the rows and
+    compact() rewrites the live rows. Compaction writes the next generation of the data files (vectors.<n>.f32 ...)
+    and switches to it by saving index.json, so a crash leaves the index as it was.
+    """
+
+    def __init__(self, index_dir: str, embedding: str = 'hashing'):
+        self.index_dir = index_dir
+        self.embedding = embedding
+        self._embed = None
+        os.makedirs(index_dir, exist_ok=True)
+        self.meta = {'embedding': embedding, 'dim': None, 'rows': 0, 'passages_bytes': 0, 'generation': 0, 'files': {}}
+        meta_path = os.path.join(index_dir, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as file:
+                meta = json.load(file)
+            if meta['embedding'] != embedding:
+                raise ValueError(f"{index_dir} was built with the {meta['embedding']} embedding, not {embedding}")
+            self.meta = meta
+            self.meta.setdefault('generation', 0)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if self._embed is None:
+            self._embed = get_embedding(self.embedding)
+        return self._embed(texts)
+
+    def _path(self, name: str, generation: int = None) -> str:
+        # Data files of generation n > 0 are named vectors.<n>.f32 and so on, index.json has no generation
+        generation = self.meta['generation'] if generation is None and name != META_FILE else generation
+        if generation:
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}.{generation}{ext}"
+        return os.path.join(self.index_dir, name)
+
+    def _save_meta(self):
+        tmp_path = self._path(f"{META_FILE}.tmp")
+        with open(tmp_path, 'w') as file:
+            json.dump(self.meta, file)
+        os.replace(tmp_path, self._path(META_FILE))
+
+    def is_current(self, srt_path: str) -> bool:
+        srt_path = os.path.abspath(srt_path)
+        known = self.meta['files'].get(srt_path)
+        stat = os.stat(srt_path)
+        if not known or known['size'] != stat.st_size:
+            return False
+        if known['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        # Touched but maybe not edited, only the content hash tells
+        if known.get('sha256') != file_sha256(srt_path):
+            return False
+        known['mtime_ns'] = stat.st_mtime_ns
+        self._save_meta()
+        return True
+
+    def add(self, srt_path: str, segments: SubtitleTable = None) -> int:
+        # Embeds one transcript and appends its passages, returns how many
+        srt_path = os.path.abspath(srt_path)
+        stat = os.stat(srt_path)
+        segments = segments if segments is not None else SubtitleTable.read_srt(srt_path)
+        rows = list(passages(segments))
+        if rows:
+            vectors = np.ascontiguousarray(self.embed([text for _, _, text in rows]), dtype=np.float32)
+            self.meta['dim'] = self.meta['dim'] or vectors.shape[1]
+            self._truncate_to_meta()
+            with open(self._path(VECTORS_FILE), 'ab') as file:
+                file.write(vectors.tobytes())
+            offsets = []
+            with open(self._path(PASSAGES_FILE), 'ab') as file:
+                for start_ms, end_ms, text in rows:
+                    offsets.append(file.tell())
+                    file.write((json.dumps([srt_path, start_ms, end_ms, text], ensure_ascii=False) + '\n').encode('utf-8'))
+                self.meta['passages_bytes'] = file.tell()
+            with open(self._path(OFFSETS_FILE), 'ab') as file:
+                file.write(np.asarray(offsets, dtype='<i8').tobytes())
+        first = self.meta['rows']
+        self.meta['rows'] += len(rows)
+        self.meta['files'][srt_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                        'sha256': file_sha256(srt_path), 'rows': [first, self.meta['rows']]}
+        # Written last, so a crash half way leaves the index as it was
+        self._save_meta()
+        return len(rows)
+
+    def _truncate_to_meta(self):
+        # Drops whatever an interrupted add wrote past the rows index.json knows about
+        for name, size in [(VECTORS_FILE, self.meta['rows'] * (self.meta['dim'] or 0) * 4),
+                           (PASSAGES_FILE, self.meta['passages_bytes']), (OFFSETS_FILE, self.meta['rows'] * 8)]:
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def update(self, srt_paths: Iterable[str]) -> int:
+        added = 0
+        for srt_path in srt_paths:
+            if not self.is_current(srt_path):
+                added += self.add(srt_path)
+        self.compact_if_needed()
+        return added
+
+    def dead_rows(self) -> int:
+        return self.meta['rows'] - sum(known['rows'][1] - known['rows'][0] for known in self.meta['files'].values())
+
+    def compact_if_needed(self, dead_fraction: float = COMPACT_DEAD_FRACTION) -> bool:
+        dead = self.dead_rows()
+        if not dead or dead < dead_fraction * self.meta['rows']:
+            return False
+        self.compact()
+        return True
+
+    def compact(self):
+        """
+        Rewrites the live rows into the next generation of data files, dropping the rows of changed transcripts.
+        """
+        if not self.meta['rows']:
+            return
+        old_generation, new_generation = self.meta['generation'], self.meta['generation'] + 1
+        vectors = self._vectors()
+        offsets = np.memmap(self._path(OFFSETS_FILE), dtype='<i8', mode='r', shape=(self.meta['rows'],))
+        files, rows, new_offsets = {}, 0, []
+        with open(self._path(VECTORS_FILE, new_generation), 'wb') as vectors_out, \
+                open(self._path(PASSAGES_FILE, new_generation), 'wb') as passages_out, \
+                open(self._path(PASSAGES_FILE), 'rb') as passages_in:
+            for source, known in sorted(self.meta['files'].items(), key=lambda item: item[1]['rows'][0]):
+                first, last = known['rows']
+                vectors_out.write(np.ascontiguousarray(vectors[first:last]).tobytes())
+                for row in range(first, last):
+                    passages_in.seek(int(offsets[row]))
+                    new_offsets.append(passages_out.tell())
+                    passages_out.write(passages_in.readline())
+                files[source] = dict(known, rows=[rows, rows + last - first])
+                rows += last - first
+            passages_bytes = passages_out.tell()
+        with open(self._path(OFFSETS_FILE, new_generation), 'wb') as file:
+            file.write(np.asarray(new_offsets, dtype='<i8').tobytes())
+        del vectors, offsets
+        print(f"Compacted {self.index_dir}: {self.meta['rows']} rows to {rows}")
+        self.meta.update(rows=rows, passages_bytes=passages_bytes, generation=new_generation, files=files)
+        self._save_meta()
+        for name in [VECTORS_FILE, PASSAGES_FILE, OFFSETS_FILE]:
+            path = self._path(name, old_generation)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _vectors(self) -> np.ndarray:
+        if not self.meta['rows']:
+            return np.zeros((0, self.meta['dim'] or 1), dtype=np.float32)
+        return np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode='r', shape=(self.meta['rows'], self.meta['dim']))
+
+    def _live_rows(self, sources: Iterable[str] = None) -> np.ndarray:
+        live = np.zeros(self.meta['rows'], dtype=bool)
+        wanted = {os.path.abspath(source) for source in sources} if sources else None
+        for source, known in self.meta['files'].items():
+            if wanted is None or source in wanted:
+                live[known['rows'][0]:known['rows'][1]] = True
+        return live
+
+    def search(self, question: str, k: int = 8, sources: Iterable[str] = None) -> List[Hit]:
+        """
+        The k passages most similar to the question (cosine), best first, optionally only from some transcripts.
+        """
+        live = self._live_rows(sources)
+        if not live.any():
+            return []
+        scores = self._vectors() @ self.embed([question])[0]
+        scores = np.where(live, scores, -np.inf)
+        k = min(k, int(live.sum()))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        offsets = np.memmap(self._path(OFFSETS_FILE), dtype='<i8', mode='r', shape=(self.meta['rows'],))
+        hits = []
+        with open(self._path(PASSAGES_FILE), 'rb') as file:
+            for row in top.tolist():
+                file.seek(int(offsets[row]))
+                source, start_ms, end_ms, text = json.loads(file.readline().decode('utf-8'))
+                hits.append(Hit(float(scores[row]), source, start_ms, end_ms, text))
+        return hits
+
+
+def file_sha256(file_path: str) -> str:
+    with open(file_path, 'rb') as file:
+        return hashlib.file_digest(file, 'sha256').hexdigest()
+
+
+def format_hits(hits: List[Hit]) -> str:
+    # Prompt lines for the retrieved passages, grouped by transcript and in time order
+    lines = []
+    for source in sorted({hit.source for hit in hits}):
+        lines.append(f"# {os.path.basename(source)}")
+        in_order = sorted((hit for hit in hits if hit.source == source), key=lambda hit: hit.start_ms)
+        starts = format_srt_times([hit.start_ms for hit in in_order])
+        ends = format_srt_times([hit.end_ms for hit in in_order])
+        lines += [f"{start} --> {end}: {hit.text}" for start, end, hit in zip(starts, ends, in_order)]
+    return "\n".join(lines)
@@ -1,22 +1,44 @@
 import argparse
 import csv
-import itertools
+import hashlib
+import io
+import json
 import os
 import re
+import signal
+import struct
 import subprocess
-from collections import namedtuple
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
+from functools import lru_cache, partial
 from enum import Enum
 from pathlib import Path
-from shutil import copyfile
-from typing import List, Tuple, NamedTuple
+from typing import Iterable, Iterator, List, Tuple, NamedTuple
 
-import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
+from materialize import Materialize, materialize
+from project_manifest import ProjectManifest, run_stage_cached
+from resource_planner import CorePool, Layout, calibrate, pinned_command, plan_layout, usable_cores
+from run_report import recorder, wait_with_rusage
+from srt_stream import (Cue, convert_seconds_to_srt_time, convert_srt_time_to_seconds, iter_cues, read_cues,
+                        write_cues)
+from word_timings import Word, WordSegment, load_word_timings, save_word_timings, words_from_whisper_cpp_json
+from work_queue import LEASE_SECONDS, WorkQueue
 
 
 
 Project = namedtuple('Project', ['source_mpeg_path', 'output_path', 'mpeg_file', 'audio_file', 'srt_file'])
+Stage = namedtuple('Stage', ['action', 'func', 'workers'])
+StageFailure = namedtuple('StageFailure', ['project', 'action', 'error'])
+FasterWhisperOptions = namedtuple('FasterWhisperOptions',
+                                  ['device', 'compute_type', 'num_workers', 'batch_size', 'cpu_threads'],
+                                  defaults=['cpu', 'int8', 1, 0, 0])
 
 
 class Action(Enum):
@@ -24,114 +46,161 @@ class Action(Enum):
     CREATE_PROJECT = 'create_project'
     EXTRACT_AUDIO = 'extract_audio'
     EXTRACT_SRT = 'extract_srt'
+    RESPLIT = 'resplit'
 
-def convert_srt_time_to_seconds(srt_time) -> float:
-    hours, minutes, seconds, milliseconds = map(float, re.split('[:,]', srt_time))
-    return hours * 3600 + minutes * 60 + seconds + milliseconds/1000
 
-def convert_seconds_to_srt_time(seconds) -> str:
-    _hours = int(seconds // 3600)
-    _minutes = int((seconds % 3600) // 60)
-    _seconds = int(seconds) % 60
-    return f"{_hours:02}:{_minutes:02}:{_seconds:06.3f}".replace('.', ',')
+class Backend(Enum):
+    WHISPER_CPP = 'whisper_cpp'
+    FASTER_WHISPER = 'faster_whisper'
 
 
+# Anything but a split char, then capture. Anything missing in capture is dropped
+# Future version to start allowing for numbers no to be split i.e. 50,000
+SENTENCE_PATTERN = re.compile(r'[^.?|,-]+[?!]?')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+CONJUNCTIONS = frozenset({'and', 'but', 'or', 'nor', 'for', 'yet', 'so'})
 
-def split_sentence_on_conjunction(sentence):
-    """
-    Drop a conjunction and split sentence into two parts
-    And that's how small groups became, let's say, chat rooms in Pirețele and I was in all the chat rooms and if I could, if I needed, I would bring them.
-    """
-    conjunctions = {'and', 'but', 'or', 'nor', 'for', 'yet', 'so'}
-    words = word_tokenize(sentence)
 
+def _split_words_on_conjunction(sentence: str, words: List[str], parts: List[str]):
+    # Works on the word list of the sentence, so the sentence is only tokenized once however deep the split goes
     if len(words) < 10:
-        return [sentence]
+        parts.append(sentence)
+        return
 
     for i in range(4, len(words) - 4):
-        if words[i] in conjunctions:
-            first_part = ' '.join(words[:i]).strip()
-            second_part = ' '.join(words[i:]).strip()
-            return split_sentence_on_conjunction(first_part) + split_sentence_on_conjunction(second_part)
+        if words[i] in CONJUNCTIONS:
+            first_words, second_words = words[:i], words[i:]
+            _split_words_on_conjunction(' '.join(first_words).strip(), first_words, parts)
+            _split_words_on_conjunction(' '.join(second_words).strip(), second_words, parts)
+            return
 
-    return [sentence]
+    parts.append(sentence)
 
 
-def split_text_into_chunks(text, total_duration):
-    # Define the tokenizer to split on commas, periods, and question marks
-    from nltk.tokenize import RegexpTokenizer
-    tokenizer = RegexpTokenizer(r'[^.?|,-]+[?!]?')
-    # Future version to start allowing for numbers no to be split i.e. 50,000
-    # tokenizer = RegexpTokenizer(r'([?!.|-]+|^\d+,^\d+|(?:[?!]))', gaps=True)
+def ensure_nltk_resource(resource: str, package: str):
+    # Look in the local nltk_data first, only go to the network when it was never downloaded
+    import nltk
+    try:
+        nltk.data.find(resource)
+    except LookupError:
+        if os.environ.get('WHISPER_TOOLS_OFFLINE'):
+            raise
+        nltk.download(package, quiet=True)
+        nltk.data.find(resource)
 
-    # Anything but a split char, then capture.  Anything missing in capture is dropped
-    sentences = tokenizer.tokenize(text)
-    total_words = len(re.split(r'\s+', text))
 
-    sentences = list(itertools.chain(*[split_sentence_on_conjunction(sent) for sent in sentences]))
+@lru_cache(maxsize=None)
+def get_word_tokenizer():
+    # nltk takes a few hundred ms to import, so it is only loaded once a transcript actually gets split
+    ensure_nltk_resource('tokenizers/punkt_tab/english/', 'punkt_tab')
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
 
-    # Create the final list of chunks with their respective durations
+
+def split_sentence_on_conjunction(sentence):
+    """
+    Drop a conjunction and split sentence into two parts
+    And that's how small groups became, let's say, chat rooms in Pirețele and I was in all the chat rooms and if I could, if I needed, I would bring them.
+    """
+    parts = []
+    _split_words_on_conjunction(sentence, get_word_tokenizer()(sentence), parts)
+    return parts
+
+
+def _split_on_max_words(chunk: str, max_words: int) -> Iterator[Tuple[str, float]]:
+    # Yields (text, share of the chunk) for balanced pieces of at most max_words words, each a cue of its own so
+    # capitalized like the chunk
+    words = chunk.split()
+    if not max_words or len(words) <= max_words:
+        yield chunk, 1.0
+        return
+    n_pieces = -(-len(words) // max_words)
+    size, extra = divmod(len(words), n_pieces)
+    start = 0
+    for k in range(n_pieces):
+        end = start + size + (1 if k < extra else 0)
+        piece = ' '.join(words[start:end])
+        yield piece[0].upper() + piece[1:], (end - start) / len(words)
+        start = end
+
+
+def chunk_words(text: str, max_words: int = None) -> Tuple[List[Tuple[str, float]], int]:
+    """
+    Splits text into subtitle chunks in a single pass.
+    Returns ([(chunk_text, n_words), ...], total_words), the word counts are the ones the chunk durations are
+    proportioned by. Without max_words the boundaries are the same as the original chunking.
+    """
+    sentences = []
+    for sent in SENTENCE_PATTERN.findall(text):
+        sentences.extend(split_sentence_on_conjunction(sent))
+    total_words = len(WHITESPACE_PATTERN.split(text))
+
+    # Create the final list of chunks with their word counts
     final_chunks = []
     current_chunks = []
     min_words = 2
     min_remaining_words = 3
     remaining_length = total_words
+    # Whitespace runs in ' '.join(current_chunks), kept up to date instead of re-joining and re-splitting
+    current_runs = 0
 
     for k, sent in enumerate(sentences):
-        current_chunks.append(sent.strip())
-        current_sent = ' '.join(current_chunks)
-        current_length = len(re.split(r'\s+', current_sent))
+        sent = sent.strip()
+        sent_runs = len(WHITESPACE_PATTERN.findall(sent))
+        if not current_chunks:
+            current_runs = sent_runs
+        else:
+            # The joining space merges with the previous one when the previous chunk was empty
+            merges = len(current_chunks) >= 2 and current_chunks[-1] == ''
+            current_runs += sent_runs + (0 if merges else 1)
+        current_chunks.append(sent)
+        current_length = current_runs + 1
         remaining_length -= current_length
 
         if current_length > min_words and remaining_length > min_remaining_words or k == len(sentences) - 1:
-
-            calc_duration = total_duration * current_length / total_words
-            #print(f"${calc_duration} = {total_duration} * {current_length} / {total_words}")
-            current_sent = current_sent[0].upper() + current_sent[1:]
-            final_chunks.append((current_sent.strip(), calc_duration))
+            current_sent = ' '.join(current_chunks)
             current_chunks = []
+            if not current_sent.strip():
+                # Only punctuation, an empty cue would not be valid srt
+                continue
+            current_sent = current_sent[0].upper() + current_sent[1:]
+            for piece, share in _split_on_max_words(current_sent.strip(), max_words):
+                final_chunks.append((piece, current_length * share))
 
-    #print(len(final_chunks), final_chunks)
-    return final_chunks
+    return final_chunks, total_words
 
 
+def split_text_into_chunks(text, total_duration, max_words=None):
+    # Returns [(chunk_text, duration), ...] with the duration split in proportion to the words in each chunk
+    chunks, total_words = chunk_words(text, max_words)
+    return [(chunk, total_duration * n_words / total_words) for chunk, n_words in chunks]
 
-def split_transcript(transcript, max_words=7) -> str:
-    # Extract start and end times from the transcript
-    # times = re.search(r'\[(.*?) --> (.*?)\]', transcript)
-
-    pattern = re.compile(r'(\d+)\n(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})\n(.*)', re.MULTILINE )
-    matches = pattern.findall(transcript)
-    if not matches:
-        raise ValueError("Invalid transcript format: missing time information")
-    output = ""
-    new_index = 0
-    for match in matches:
-        index, start_time_str, end_time_str, text = match
-        start_time = convert_srt_time_to_seconds(start_time_str)
-        end_time = convert_srt_time_to_seconds(end_time_str)
 
-        chunks = split_text_into_chunks(text, end_time - start_time)
+def split_cues(cues: Iterable[Cue], max_words=7) -> Iterator[Cue]:
+    # Split each cue into shorter cues, one cue at a time
+    for cue in cues:
+        chunks = split_text_into_chunks(cue.text.replace('\n', ' '), cue.end - cue.start, max_words=max_words)
 
         # Calculate the start and end times for each chunk
-        chunk_times = []
         timeline = 0
-        for i in range(len(chunks)):
-            chunk_times.append(
-                            (start_time + timeline,
-                            start_time + timeline + chunks[i][1]))
-            timeline += chunks[i][1]
+        for chunk_txt, duration in chunks:
+            yield Cue(None, cue.start + timeline, cue.start + timeline + duration, chunk_txt)
+            timeline += duration
 
 
-        # Construct the output
-        for (chunk_txt, duration), times in zip(chunks, chunk_times):
-            new_index += 1
-            output += f"{new_index}\n"
-            output += f"{convert_seconds_to_srt_time(times[0])} --> {convert_seconds_to_srt_time(times[1])}\n"
-            output += f"{chunk_txt}\n\n"
+def _require_cues(cues: Iterable[Cue]) -> Iterator[Cue]:
+    found = False
+    for cue in cues:
+        found = True
+        yield cue
+    if not found:
+        raise ValueError("Invalid transcript format: missing time information")
+
 
-    # Construct the output
-    return output
+def split_transcript(transcript, max_words=7) -> str:
+    output = io.StringIO()
+    write_cues(output, split_cues(_require_cues(iter_cues(transcript.splitlines())), max_words=max_words))
+    return output.getvalue()
 
 
 def read_file(file_path):
@@ -147,9 +216,75 @@ def action_type(action):
         raise argparse.ArgumentTypeError(f"Invalid action: {action}. Allowed actions are: {', '.join([a.value for a in Action])}")
 
 
-def run_command_check(cmd, code = 0):
-    # Run the command
-    result = subprocess.run(cmd, shell=True)
+class StageCancelled(Exception):
+    pass
+
+
+class ProjectProcesses:
+    """
+    Subprocesses running for each project, keyed like the run report by the current stage's project, so helper
+    threads charged to the stage count too. Cancelling a project (a worker lost its lease) terminates them, and the
+    stage raises StageCancelled instead of going on.
+    """
+
+    def __init__(self):
+        self._running = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _project() -> str:
+        record = recorder.current()
+        return record['project'] if record else None
+
+    def check(self):
+        if self._project() in self._cancelled:
+            raise StageCancelled(f"{self._project()} was cancelled")
+
+    @contextmanager
+    def track(self, process: subprocess.Popen):
+        project = self._project()
+        with self._lock:
+            self._running.setdefault(project, set()).add(process)
+            if project in self._cancelled:
+                self._terminate(process)
+        try:
+            yield process
+        finally:
+            with self._lock:
+                self._running[project].discard(process)
+        self.check()
+
+    @staticmethod
+    def _terminate(process: subprocess.Popen):
+        # Not process.terminate(), its poll() could reap the child before wait_with_rusage does
+        try:
+            os.kill(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def cancel(self, project: str):
+        with self._lock:
+            self._cancelled.add(project)
+            for process in self._running.get(project, ()):
+                self._terminate(process)
+
+    def reset(self, project: str):
+        with self._lock:
+            self._cancelled.discard(project)
+
+
+running = ProjectProcesses()
+
+
+def run_command_check(cmd, code = 0, cpus: List[int] = None):
+    # Run the command, its wall time, CPU, memory and I/O go into the run report. cpus pins it to those cores
+    running.check()
+    start = time.perf_counter()
+    result = subprocess.Popen(pinned_command(cmd, cpus), shell=True)
+    with running.track(result):
+        _, usage = wait_with_rusage(result)
+    recorder.record_subprocess(cmd, time.perf_counter() - start, usage)
 
     # Check if the output is 0
     if result.returncode == code:
@@ -196,42 +331,613 @@ def read_projects(project_csv_path, filter_proj=None, output_dir_override=None)
 
     return projects
 
-def create_project(proj: Project):
+def create_project(proj: Project, strategy: Materialize = Materialize.AUTO, force=False):
     os.makedirs(proj.output_path, exist_ok=True)
-    # Copy the source file to the project folder
+    # Link (or copy) the source file into the project folder
     project_mpeg_path = os.path.join(proj.output_path, proj.mpeg_file)
     print(proj)
-    copyfile(proj.source_mpeg_path, project_mpeg_path)
 
-def extract_audio(proj: Project) -> str:
+    def materialize_source():
+        used = materialize(proj.source_mpeg_path, project_mpeg_path, strategy)
+        print(f"{project_mpeg_path}: {used.value if used else 'already present'}")
+
+    manifest = ProjectManifest(proj.output_path, Path(proj.mpeg_file).stem)
+    # The strategy too, switching to --materialize copy has to replace a link. The source is not hashed here,
+    # extract_audio hashes the project's copy, which for a reflink or copy is another inode and another full read
+    inputs = {'source': manifest.file_stamp(proj.source_mpeg_path), 'strategy': strategy.value}
+    run_stage_cached(manifest, 'create_project', inputs, [project_mpeg_path], materialize_source, force)
+
+def extract_audio(proj: Project, single_pass=False, force=False) -> str:
     # Takes a mpeg file and extracts audio in preparation for srt
     audio_name = Path(proj.audio_file).stem
     mpeg_path = os.path.join(proj.output_path, proj.mpeg_file)
     audio_aac_path = os.path.join(proj.output_path, f"{audio_name}.aac")
     audio_path = os.path.join(proj.output_path, proj.audio_file)
-    ffmpeg_1 = f"ffmpeg -y -i \"{mpeg_path}\" -vn -acodec copy \"{audio_aac_path}\""
-    ffmpeg_2 = f"ffmpeg -y -i \"{audio_aac_path}\" -acodec pcm_s16le -ar 16000 \"{audio_path}\""
-    run_command_check(ffmpeg_1)
-    run_command_check(ffmpeg_2)
+
+    def two_pass():
+        ffmpeg_1 = f"ffmpeg -y -i \"{mpeg_path}\" -vn -acodec copy \"{audio_aac_path}\""
+        ffmpeg_2 = f"ffmpeg -y -i \"{audio_aac_path}\" -acodec pcm_s16le -ar 16000 \"{audio_path}\""
+        run_command_check(ffmpeg_1)
+        run_command_check(ffmpeg_2)
+
+    manifest = ProjectManifest(proj.output_path, Path(proj.mpeg_file).stem)
+    inputs = {'mpeg': manifest.file_digest(mpeg_path), 'single_pass': single_pass}
+    run_stage_cached(manifest, 'extract_audio', inputs, [audio_path],
+                     partial(extract_audio_single_pass, proj) if single_pass else two_pass, force)
     return audio_path
 
-def extract_srt(proj: Project, max_words:int, duration:int, model_name):
-    # Takes an audio file and create an optimized srt file
+def ffmpeg_pcm_cmd(mpeg_path: str, output: str = '-', duration: int = None) -> List[str]:
+    # Decode straight to 16 kHz mono 16 bit PCM wav, which is what whisper wants
+    cmd = ['ffmpeg', '-nostdin', '-y', '-loglevel', 'error', '-i', mpeg_path]
+    if duration:
+        cmd += ['-t', str(duration)]
+    return cmd + ['-vn', '-ac', '1', '-ar', '16000', '-c:a', 'pcm_s16le', '-f', 'wav', output]
+
+
+def extract_audio_single_pass(proj: Project) -> str:
+    # Same as extract_audio, but one ffmpeg pass and no intermediate .aac
+    mpeg_path = os.path.join(proj.output_path, proj.mpeg_file)
+    audio_path = os.path.join(proj.output_path, proj.audio_file)
+    run_command_check(subprocess.list2cmdline(ffmpeg_pcm_cmd(mpeg_path, audio_path)))
+    return audio_path
+
+
+def _finalize_wav_header(wav_path: str):
+    # ffmpeg writing to a pipe can't seek back, so the RIFF and data sizes are left as placeholders
+    with open(wav_path, 'r+b') as wav_file:
+        file_size = wav_file.seek(0, os.SEEK_END)
+        wav_file.seek(0)
+        header = wav_file.read(min(file_size, 1024))
+        data_pos = header.find(b'data')
+        if header[:4] != b'RIFF' or data_pos < 0:
+            return
+        wav_file.seek(4)
+        wav_file.write(struct.pack('<I', min(file_size - 8, 0xFFFFFFFF)))
+        wav_file.seek(data_pos + 4)
+        wav_file.write(struct.pack('<I', min(file_size - data_pos - 8, 0xFFFFFFFF)))
+
+
+def stream_audio(mpeg_path: str, sink, wav_path: str = None, duration: int = None, chunk_size: int = 1 << 20):
+    """
+    Decode the audio track of mpeg_path in one ffmpeg pass and write the wav stream into sink (a writable
+    binary file object, e.g. the stdin of a whisper process). The wav is also kept on disk when wav_path is set.
+    Returns the seconds of audio decoded.
+    """
+    start = time.perf_counter()
+    cmd = ffmpeg_pcm_cmd(mpeg_path, '-', duration)
+    ffmpeg = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    wav_file = open(wav_path, 'wb') if wav_path else None
+    streamed = 0
+    with running.track(ffmpeg):
+        try:
+            while chunk := ffmpeg.stdout.read(chunk_size):
+                streamed += len(chunk)
+                if wav_file:
+                    wav_file.write(chunk)
+                try:
+                    sink.write(chunk)
+                except BrokenPipeError:
+                    # The consumer exited early, its return code tells us why
+                    break
+        finally:
+            ffmpeg.stdout.close()
+            if wav_file:
+                wav_file.close()
+            _, usage = wait_with_rusage(ffmpeg)
+    recorder.record_subprocess(cmd, time.perf_counter() - start, usage)
+    if ffmpeg.returncode != 0:
+        raise Exception(f"ffmpeg failed with return code:{ffmpeg.returncode}")
+    if wav_path:
+        _finalize_wav_header(wav_path)
+    # 16 kHz mono 16 bit, the few header bytes don't matter
+    return streamed / 32000
+
+
+def wav_duration(wav_path: str) -> float:
+    with wave.open(wav_path, 'rb') as wav_file:
+        return wav_file.getnframes() / wav_file.getframerate()
+
+
+def whisper_cpp_cmd(input_path: str, model_name: str, duration: int = None, output_prefix: str = None,
+                    threads: int = None) -> str:
+    duration_cmd = f"-d {duration * 1000} " if duration else ""
+    output_cmd = f"-of \"{output_prefix}\" " if output_prefix else ""
+    # Without -t whisper.cpp takes 4 threads whatever the machine, see resource_planner
+    threads_cmd = f"-t {threads} -p 1 " if threads else ""
+    # -ojf also writes the full json with per token timings, see write_word_timings_sidecar
+    return f"./whisper.cpp/main -l en -lpt 2.0 -osrt -ojf -m ./whisper.cpp/models/{model_name} {threads_cmd}{duration_cmd}{output_cmd}-f \"{input_path}\""
+
+
+# Lines of whisper's stderr put in the error when it fails
+STDERR_TAIL_LINES = 20
+
+
+def _tee_stderr(stderr, tail: deque):
+    # Copies a child's stderr to ours line by line and keeps the last lines in tail
+    for line in iter(stderr.readline, b''):
+        sys.stderr.buffer.write(line)
+        sys.stderr.flush()
+        tail.append(line.decode(errors='replace').rstrip())
+    stderr.close()
+
+
+def transcribe_streaming(proj: Project, duration: int, model_name, keep_wav=False, threads: int = None,
+                         cpus: List[int] = None):
+    # Pipe ffmpeg straight into whisper.cpp, the wav on disk is optional
     project_audio_path = os.path.join(proj.output_path, proj.audio_file)
+    mpeg_path = os.path.join(proj.output_path, proj.mpeg_file)
+    # -of keeps whisper writing <audio>.wav.srt as if it had read the wav from disk
+    whisper_cmd = whisper_cpp_cmd('-', model_name, duration, output_prefix=project_audio_path, threads=threads)
+    start = time.perf_counter()
+    whisper = subprocess.Popen(pinned_command(whisper_cmd, cpus), shell=True, stdin=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    # whisper's log still goes to the console, the end of it is kept for the error
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    tee = threading.Thread(target=_tee_stderr, args=(whisper.stderr, stderr_tail), daemon=True)
+    tee.start()
+    stream_error = None
+    with running.track(whisper):
+        try:
+            recorder.set_audio_seconds(stream_audio(mpeg_path, whisper.stdin,
+                                                    project_audio_path if keep_wav else None, duration))
+        except Exception as e:
+            # When whisper exits early ffmpeg fails on the closed pipe, that is only a symptom
+            stream_error = e
+        finally:
+            try:
+                whisper.stdin.close()
+            except BrokenPipeError:
+                pass
+            _, usage = wait_with_rusage(whisper)
+            tee.join()
+            recorder.record_subprocess(whisper_cmd, time.perf_counter() - start, usage)
+    if whisper.returncode != 0:
+        raise Exception(f"whisper failed with return code:{whisper.returncode}\n" + '\n'.join(stderr_tail)) \
+            from stream_error
+    if stream_error:
+        raise stream_error
+
+
+def transcribe_chunked(project_audio_path: str, model_name, duration: int, chunk_seconds: int, cores: CorePool):
+    """
+    Cuts the wav at quiet points into chunks of about chunk_seconds and runs whisper.cpp on them in parallel, as many
+    at a time as the core plan has jobs. The chunk transcripts are stitched into the same <audio>.wav.srt and word
+    timings sidecar a single whisper run writes.
+    """
+    # chunked_transcribe needs numpy, only loaded when --chunk_minutes is used
+    from chunked_transcribe import plan_chunks, stitch_chunks, write_chunk_wav
+    chunks = plan_chunks(project_audio_path, chunk_seconds, duration)
+    print(f"{project_audio_path}: {len(chunks)} chunks, {min(cores.layout.jobs, len(chunks))} at a time")
+    # Chunk wavs are cut on helper threads
+    recorder.use_process_usage()
+    record = recorder.current()
 
-    duration_cmd = f"-d {duration * 1000}" if duration else ""
-    whisper_cmd = [f"./whisper.cpp/main -l en -lpt 2.0 -osrt -m ./whisper.cpp/models/{model_name} {duration_cmd }-f \"{project_audio_path}\""]
+    with tempfile.TemporaryDirectory(prefix='chunks_', dir=os.path.dirname(project_audio_path) or '.') as work_dir:
+        def transcribe_chunk(k: int):
+            chunk_path = os.path.join(work_dir, f"chunk_{k:04}.wav")
+            write_chunk_wav(project_audio_path, chunks[k], chunk_path)
+            with recorder.charge_to(record), cores.slot() as cpus:
+                run_command_check(whisper_cpp_cmd(chunk_path, model_name, output_prefix=chunk_path,
+                                                  threads=cores.layout.threads), cpus=cpus)
+            return chunks[k], list(read_cues(f"{chunk_path}.srt")), words_from_whisper_cpp_json(f"{chunk_path}.json")
+
+        with ThreadPoolExecutor(max_workers=cores.layout.jobs) as executor:
+            results = list(executor.map(transcribe_chunk, range(len(chunks))))
+
+    cues, segments = stitch_chunks(results)
+    with open(f"{project_audio_path}.srt", 'w', encoding='utf-8') as srt_file:
+        write_cues(srt_file, cues)
+    save_word_timings(f"{project_audio_path}.words.json", [segment for segment in segments if segment])
+
+
+def optimized_srt_path(srt_file_path: str) -> str:
+    output_file_path = Path(srt_file_path)
+    return str(output_file_path.with_name(output_file_path.stem + '_optimized.srt'))
 
-    run_command_check(whisper_cmd)
+
+def write_optimized_srt(srt_file_path: str, max_words: int) -> str:
+    output_file_path = optimized_srt_path(srt_file_path)
+    # Streams cue by cue from the whisper srt into the optimized one
+    with open(output_file_path, 'w', encoding='utf-8') as output_file:
+        write_cues(output_file, split_cues(_require_cues(read_cues(srt_file_path)), max_words=max_words))
+    return output_file_path
+
+
+def write_word_timings_sidecar(project_audio_path: str) -> str:
+    # Keep only the word timings from whisper.cpp's (large) full json output
+    json_path = f"{project_audio_path}.json"
+    words_path = f"{project_audio_path}.words.json"
+    save_word_timings(words_path, words_from_whisper_cpp_json(json_path))
+    os.remove(json_path)
+    return words_path
+
+
+def resplit_cues(segments: Iterable[WordSegment], max_words=7) -> Iterator[Cue]:
+    # Same chunks as split_cues, but each chunk is timed by the words it covers instead of by its share of words
+    for segment in segments:
+        words = segment.words
+        if not words:
+            continue
+        text = ''.join(word.word for word in words)
+        # Index in words of every letter or digit of text. The chunks keep these in order and only change the
+        # punctuation and spacing around them ('twenty-five', '1,000', ' - '), so counting them lines the chunks up
+        # with the words
+        owners = [i for i, word in enumerate(words) for _ in word.word]
+        letter_owners = [owners[i] for i, char in enumerate(text) if char.isalnum()]
+        if not letter_owners:
+            continue
+        chunks, _ = chunk_words(text, max_words)
+        counted = 0
+        first = 0
+        for k, (chunk_txt, _) in enumerate(chunks):
+            counted += sum(char.isalnum() for char in chunk_txt)
+            last = (len(words) - 1 if k == len(chunks) - 1
+                    else letter_owners[max(1, min(counted, len(letter_owners))) - 1])
+            first = min(first, last)
+            yield Cue(None, words[first].start / 1000, words[last].end / 1000, chunk_txt)
+            first = last + 1
+
+
+def write_resplit_srt(words_path: str, output_file_path: str, max_words: int) -> str:
+    with open(output_file_path, 'w', encoding='utf-8') as output_file:
+        write_cues(output_file, resplit_cues(load_word_timings(words_path), max_words=max_words))
+    return output_file_path
+
+
+def faster_whisper_model_name(model_name: str) -> str:
+    # -l takes whisper.cpp file names, ggml-large-v3.bin is large-v3 for faster_whisper. Paths pass through
+    if os.path.isdir(model_name):
+        return model_name
+    name = Path(model_name).name
+    if name.startswith('ggml-'):
+        name = name[len('ggml-'):]
+    if name.endswith('.bin'):
+        name = name[:-len('.bin')]
+    return name
+
+
+_faster_whisper_models = {}
+_faster_whisper_models_lock = threading.Lock()
+
+
+def get_faster_whisper_model(model_name: str, options: FasterWhisperOptions):
+    # One WhisperModel per run, shared by every project. num_workers lets --srt_jobs projects transcribe at once
+    key = (faster_whisper_model_name(model_name), options.device, options.compute_type, options.num_workers,
+           options.cpu_threads)
+    with _faster_whisper_models_lock:
+        if key not in _faster_whisper_models:
+            from faster_whisper import WhisperModel
+            print(f"Loading faster_whisper model {key[0]} ({options.device}, {options.compute_type})")
+            _faster_whisper_models[key] = WhisperModel(key[0], device=options.device, compute_type=options.compute_type,
+                                                       num_workers=max(1, options.num_workers),
+                                                       cpu_threads=options.cpu_threads)
+        return _faster_whisper_models[key]
+
+
+def read_audio_pcm(mpeg_path: str, duration: int = None):
+    # Decode into memory as float32 samples in [-1, 1], the format faster_whisper takes
+    import numpy as np
+    buffer = io.BytesIO()
+    stream_audio(mpeg_path, buffer, duration=duration)
+    wav = buffer.getbuffer()
+    data_pos = bytes(wav[:1024]).find(b'data')
+    if data_pos < 0:
+        raise Exception(f"ffmpeg returned no audio for {mpeg_path}")
+    samples = np.frombuffer(wav, dtype='<i2', offset=data_pos + 8, count=(len(wav) - data_pos - 8) // 2)
+    return samples.astype(np.float32) / 32768.0
+
+
+def transcribe_faster_whisper(proj: Project, duration: int, model_name, options: FasterWhisperOptions,
+                              streaming=False):
+    # Writes the same <audio>.wav.srt and word timings sidecar as the whisper.cpp backend
+    project_audio_path = os.path.join(proj.output_path, proj.audio_file)
+    if streaming:
+        audio = read_audio_pcm(os.path.join(proj.output_path, proj.mpeg_file), duration)
+    else:
+        from faster_whisper import decode_audio
+        audio = decode_audio(project_audio_path, sampling_rate=16000)
+        if duration:
+            audio = audio[:duration * 16000]
+    audio_seconds = len(audio) / 16000
+    recorder.set_audio_seconds(audio_seconds)
+    # Inference runs on CTranslate2's own threads
+    recorder.use_process_usage()
+
+    model = get_faster_whisper_model(model_name, options)
+    start = time.perf_counter()
+    if options.batch_size:
+        # VAD chunks of the interview are transcribed batch_size at a time, in order, so the segments come out in
+        # timestamp order as each batch is done
+        from faster_whisper import BatchedInferencePipeline
+        segments, info = BatchedInferencePipeline(model=model).transcribe(audio, language='en', word_timestamps=True,
+                                                                          batch_size=options.batch_size)
+    else:
+        segments, info = model.transcribe(audio, language='en', word_timestamps=True)
+    word_segments = []
+
+    def cues():
+        # Segments are decoded lazily, each cue is written as soon as whisper produces it
+        for segment in segments:
+            running.check()
+            word_segments.append(WordSegment(round(segment.start * 1000), round(segment.end * 1000),
+                                             [Word(round(w.start * 1000), round(w.end * 1000), w.word)
+                                              for w in segment.words or []]))
+            yield Cue(None, segment.start, segment.end, segment.text)
+
+    with open(f"{project_audio_path}.srt", 'w', encoding='utf-8') as srt_file:
+        write_cues(srt_file, cues())
+    save_word_timings(f"{project_audio_path}.words.json", word_segments)
+
+    elapsed = time.perf_counter() - start
+    rtf = elapsed / audio_seconds if audio_seconds else 0
+    print(f"{proj.output_path}: {audio_seconds:.0f}s of audio in {elapsed:.0f}s, real-time factor {rtf:.3f}")
+
+
+def extract_srt(proj: Project, max_words:int, duration:int, model_name, streaming=False, keep_wav=False, force=False,
+                backend: Backend = Backend.WHISPER_CPP, options: FasterWhisperOptions = None, cores: CorePool = None,
+                chunk_minutes: float = None):
+    # Takes an audio file and create an optimized srt file
+    project_audio_path = os.path.join(proj.output_path, proj.audio_file)
+    mpeg_path = os.path.join(proj.output_path, proj.mpeg_file)
     audio_path = Path(project_audio_path)
     srt_file_path = f"{audio_path}.srt"
-    file_content = read_file(srt_file_path)
-    file_output = split_transcript(file_content, max_words=max_words)
+    words_path = f"{audio_path}.words.json"
+    manifest = ProjectManifest(proj.output_path, Path(proj.mpeg_file).stem)
+
+    if streaming:
+        transcribe_inputs = {'mpeg': manifest.file_digest(mpeg_path)}
+    else:
+        transcribe_inputs = {'audio': manifest.file_digest(project_audio_path)}
+    transcribe_inputs.update(model=model_name, duration=duration, backend=backend.value)
+    if chunk_minutes:
+        transcribe_inputs.update(chunk_minutes=chunk_minutes)
+
+    if backend == Backend.FASTER_WHISPER:
+        options = options or FasterWhisperOptions()
+        transcribe_inputs.update(compute_type=options.compute_type, batch_size=options.batch_size)
+        transcribe = partial(transcribe_faster_whisper, proj, duration, model_name, options, streaming)
+    else:
+        cores = cores or CorePool(plan_layout(1))
+        threads = cores.layout.threads
+
+        def transcribe():
+            if not streaming:
+                audio_seconds = wav_duration(project_audio_path)
+                recorder.set_audio_seconds(min(audio_seconds, duration) if duration else audio_seconds)
+            if chunk_minutes:
+                # Writes the srt and the word timings sidecar itself
+                transcribe_chunked(project_audio_path, model_name, duration, round(chunk_minutes * 60), cores)
+            else:
+                # Each running whisper gets its own cores
+                with cores.slot() as cpus:
+                    if streaming:
+                        transcribe_streaming(proj, duration, model_name, keep_wav, threads, cpus)
+                    else:
+                        run_command_check(whisper_cpp_cmd(project_audio_path, model_name, duration,
+                                                          output_prefix=project_audio_path, threads=threads),
+                                          cpus=cpus)
+                write_word_timings_sidecar(project_audio_path)
+
+    run_stage_cached(manifest, 'transcribe', transcribe_inputs, [srt_file_path, words_path], transcribe, force)
+
+    # Only this cheap step re-runs when just max_words changes. Built from the word timings, the same as
+    # -a resplit so the two don't keep overwriting each other's split_transcript, the srt only for older projects
+    if os.path.exists(words_path):
+        resplit_srt(proj, max_words, force)
+        return
+    split_inputs = {'srt': manifest.file_digest(srt_file_path), 'max_words': max_words}
+    run_stage_cached(manifest, 'split_transcript', split_inputs, [optimized_srt_path(srt_file_path)],
+                     partial(write_optimized_srt, srt_file_path, max_words), force)
+
+
+def resplit_srt(proj: Project, max_words: int, force=False):
+    # Rebuilds the optimized srt from the stored word timings, whisper is not run again
+    project_audio_path = os.path.join(proj.output_path, proj.audio_file)
+    words_path = f"{project_audio_path}.words.json"
+    output_file_path = optimized_srt_path(f"{project_audio_path}.srt")
+    manifest = ProjectManifest(proj.output_path, Path(proj.mpeg_file).stem)
+    inputs = {'words': manifest.file_digest(words_path), 'max_words': max_words}
+    run_stage_cached(manifest, 'split_transcript', inputs, [output_file_path],
+                     partial(write_resplit_srt, words_path, output_file_path, max_words), force)
+
+class PipelineScheduler:
+    """
+    Pipelines projects across stages. Each stage has its own thread pool sized by its concurrency limit,
+    so one project can be copying while another runs ffmpeg and a third runs whisper.
+    A project that fails a stage is recorded and does not continue to the next stage.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+        self.failures: List[StageFailure] = []
+        self._executors = []
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._done = threading.Event()
+
+    def run(self, projects: List[Project]) -> List[StageFailure]:
+        if not projects or not self.stages:
+            return self.failures
+        self._executors = [ThreadPoolExecutor(max_workers=max(1, stage.workers), thread_name_prefix=stage.action.value)
+                           for stage in self.stages]
+        self._pending = len(projects)
+        try:
+            for proj in projects:
+                self._submit(0, proj)
+            self._done.wait()
+        finally:
+            for executor in self._executors:
+                executor.shutdown(wait=True)
+        return self.failures
+
+    def _submit(self, stage_index: int, proj: Project):
+        future = self._executors[stage_index].submit(self.stages[stage_index].func, proj)
+        future.add_done_callback(lambda f: self._on_stage_done(stage_index, proj, f))
+
+    def _on_stage_done(self, stage_index: int, proj: Project, future):
+        error = future.exception()
+        if error is not None:
+            with self._lock:
+                self.failures.append(StageFailure(proj, self.stages[stage_index].action, error))
+        elif stage_index + 1 < len(self.stages):
+            self._submit(stage_index + 1, proj)
+            return
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._done.set()
+
+
+def calibrate_layout(proj: Project, model_name: str, strategy: Materialize = Materialize.AUTO, single_pass=False,
+                     streaming=False, clip_seconds: int = 60) -> Layout:
+    # Times whisper.cpp on the first clip_seconds of the project for a few jobs x threads splits of the cores, with
+    # the audio prepared the way the run will, so streaming runs are timed with ffmpeg piping into each whisper
+    create_project(proj, strategy=strategy)
+    mpeg_path = os.path.join(proj.output_path, proj.mpeg_file)
+    if streaming:
+        with open(os.devnull, 'wb') as devnull:
+            audio_seconds = stream_audio(mpeg_path, devnull, duration=clip_seconds)
+    else:
+        audio_path = extract_audio(proj, single_pass=single_pass)
+        audio_seconds = min(clip_seconds, wav_duration(audio_path))
+
+    def trial(layout: Layout) -> float:
+        cores = CorePool(layout)
+        with tempfile.TemporaryDirectory() as work_dir:
+            def run(k):
+                output_prefix = os.path.join(work_dir, str(k))
+                with cores.slot() as cpus:
+                    if streaming:
+                        # Only whisper is pinned, as in transcribe_streaming
+                        whisper_cmd = whisper_cpp_cmd('-', model_name, clip_seconds, output_prefix=output_prefix,
+                                                      threads=layout.threads)
+                        run_command_check(f"{subprocess.list2cmdline(ffmpeg_pcm_cmd(mpeg_path, '-', clip_seconds))}"
+                                          f" | {pinned_command(whisper_cmd, cpus)}")
+                    else:
+                        run_command_check(whisper_cpp_cmd(audio_path, model_name, clip_seconds,
+                                                          output_prefix=output_prefix, threads=layout.threads),
+                                          cpus=cpus)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=layout.jobs) as executor:
+                list(executor.map(run, range(layout.jobs)))
+            return layout.jobs * audio_seconds / (time.perf_counter() - start)
+
+    return calibrate(trial, model_name)
+
+
+def build_stages(args, layout: Layout) -> List[Stage]:
+    all_stages = [
+        Stage(Action.CREATE_PROJECT, partial(create_project, strategy=args.materialize, force=args.force),
+              args.copy_jobs),
+        Stage(Action.EXTRACT_AUDIO, partial(extract_audio, single_pass=args.single_pass_audio, force=args.force),
+              args.audio_jobs),
+        Stage(Action.EXTRACT_SRT, partial(extract_srt, max_words=args.max_words, duration=args.duration,
+                                          model_name=args.model, streaming=args.stream_audio,
+                                          keep_wav=args.keep_wav, force=args.force, backend=args.backend,
+                                          options=FasterWhisperOptions(args.device, args.compute_type, layout.jobs,
+                                                                       args.batch_size, layout.threads),
+                                          cores=CorePool(layout), chunk_minutes=args.chunk_minutes), layout.jobs),
+    ]
+    if args.action == Action.RESPLIT:
+        return [Stage(Action.RESPLIT, partial(resplit_srt, max_words=args.max_words, force=args.force), layout.jobs)]
+    if args.action == Action.ALL:
+        stages = all_stages
+    else:
+        stages = [stage for stage in all_stages if stage.action == args.action]
+    if args.stream_audio:
+        # Audio is decoded inside extract_srt, there is no separate ffmpeg stage
+        stages = [stage for stage in stages if stage.action != Action.EXTRACT_AUDIO]
+    return stages
+
+
+def project_job_id(proj: Project) -> str:
+    # Project folder plus file name, unique even when -o puts every project in one folder
+    return re.sub(r'[^\w.-]', '_', f"{os.path.basename(proj.output_path)}_{Path(proj.mpeg_file).stem}")
+
+
+# Arguments that change what the stages write, workers only share a queue when these are the same
+QUEUE_SETTINGS = ['action', 'max_words', 'duration', 'model', 'backend', 'device', 'compute_type', 'batch_size',
+                  'materialize', 'chunk_minutes', 'single_pass_audio', 'stream_audio', 'keep_wav', 'force']
+
+
+def queue_run_name(args) -> str:
+    # e.g. all_1f3a9c2e, so a run with another -a or -m doesn't find the first run's projects already done
+    settings = json.dumps({name: str(getattr(args, name)) for name in QUEUE_SETTINGS}, sort_keys=True)
+    return f"{args.action.value}_{hashlib.sha256(settings.encode()).hexdigest()[:8]}"
+
+
+def run_worker(stages: List[Stage], projects: List[Project], queue: WorkQueue, slots: int) -> Tuple[List[StageFailure], int]:
+    """
+    Worker mode: claims projects from a queue shared with workers on other hosts and runs every stage on each, slots
+    projects at a time. Keeps going until every project is done or failed, projects held by other workers are
+    waited on so they can be taken over if that worker dies, and a project taken over from this worker is stopped
+    in the middle of its stage. Returns the failures and the projects this worker ran.
+    """
+    jobs = {project_job_id(proj): proj for proj in projects}
+    failures: List[StageFailure] = []
+    ran = []
+    lock = threading.Lock()
+
+    def stage_project(proj: Project) -> str:
+        # The project key the stages' subprocesses are tracked by
+        return ProjectManifest(proj.output_path, Path(proj.mpeg_file).stem).project
+
+    def lost(job_id: str):
+        # From the heartbeat thread: stop the running stage now rather than when it ends
+        print(f"{queue.worker_id} lost {job_id}, stopping its stage")
+        running.cancel(stage_project(jobs[job_id]))
+
+    def work():
+        while True:
+            job_id = queue.claim_next(jobs)
+            if job_id is None:
+                if all(queue.is_finished(other) for other in jobs):
+                    return
+                time.sleep(queue.lease_seconds / 4)
+                continue
+            proj = jobs[job_id]
+            print(f"{queue.worker_id} claimed {job_id}")
+            running.reset(stage_project(proj))
+            with lock:
+                ran.append(job_id)
+            for stage in stages:
+                if not queue.holds(job_id):
+                    # Another worker reclaimed the lease, it runs the project now
+                    print(f"{queue.worker_id} lost {job_id}, stopping before {stage.action.value}")
+                    break
+                try:
+                    stage.func(proj)
+                except StageCancelled:
+                    break
+                except Exception as e:
+                    with lock:
+                        failures.append(StageFailure(proj, stage.action, e))
+                    if queue.holds(job_id):
+                        queue.fail(job_id, f"[{stage.action.value}] {e}")
+                    break
+            else:
+                if queue.holds(job_id):
+                    queue.complete(job_id)
+
+    queue.start_heartbeat(on_lost=lost)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, slots), thread_name_prefix='worker') as executor:
+            for future in [executor.submit(work) for _ in range(max(1, slots))]:
+                future.result()
+    finally:
+        queue.stop_heartbeat()
+    return failures, len(ran)
+
+
+def print_failures(failures: List[StageFailure], total: int):
+    if not failures:
+        print(f"All {total} projects completed")
+        return
+    print(f"{len(failures)} of {total} projects failed:")
+    for failure in failures:
+        print(f"  [{failure.action.value}] {failure.project.output_path}: {failure.error}")
 
-    output_file_path = Path(srt_file_path)
-    output_file_path = output_file_path.with_name(output_file_path.stem + '_optimized.srt')
-    with output_file_path.open('w') as output_file:
-        output_file.write(file_output)
 
 def main():
     parser = argparse.ArgumentParser(description='Process a mpeg file source and creates a project file with SRT and AUDIO assests')
@@ -244,39 +950,89 @@ def main():
     parser.add_argument('-f', '--filter', type=str, default=None, help='a filter on which projects to process by regex')
     parser.add_argument('-l', '--model', type=str, default="ggml-large-v3.bin", help='Pick model', required=False)
     parser.add_argument('-o', '--output_dirname_override', type=str, default=None, help='OVERRIDE ALL to be in a single folder', required=False)
+    parser.add_argument('--backend', type=Backend, choices=list(Backend), default=Backend.WHISPER_CPP,
+                        help='whisper.cpp subprocess per project, or faster_whisper loaded once in process')
+    parser.add_argument('--device', type=str, default='cpu', help='faster_whisper device, cpu or cuda')
+    parser.add_argument('--compute_type', type=str, default='int8',
+                        help='faster_whisper compute type, e.g. int8 or int8_float32 on CPU')
+    parser.add_argument('--batch_size', type=int, default=0,
+                        help='faster_whisper: transcribe this many VAD chunks per forward pass, 0 is sequential')
+    parser.add_argument('--materialize', type=Materialize, choices=list(Materialize), default=Materialize.AUTO,
+                        help='How the source mp4 is put in the project folder, auto tries reflink, hardlink then symlink')
+    parser.add_argument('--copy_jobs', type=int, default=2, help='Projects copied at the same time')
+    parser.add_argument('--audio_jobs', type=int, default=2, help='ffmpeg audio extractions run at the same time')
+    parser.add_argument('--srt_jobs', type=int, default=None,
+                        help='whisper transcriptions run at the same time, default planned from the usable cores')
+    parser.add_argument('--threads', type=int, default=None, help='Threads per whisper transcription, default cores / srt_jobs')
+    parser.add_argument('--chunk_minutes', type=float, default=None,
+                        help='whisper.cpp: cut each wav at quiet points into chunks this long and transcribe them in parallel')
+    parser.add_argument('--worker', action='store_true',
+                        help='Claim projects from a queue shared with workers on other hosts until the CSV is drained')
+    parser.add_argument('--queue_dir', type=str, default=None,
+                        help='Shared queue folder for --worker, default .whisper_queue/<csv name> next to the CSV. '
+                             'Each action and settings gets its own queue in it')
+    parser.add_argument('--worker_slots', type=int, default=None,
+                        help='Projects a worker runs at once, default one more than the whisper jobs')
+    parser.add_argument('--lease_seconds', type=float, default=LEASE_SECONDS,
+                        help='A claimed project without a heartbeat for this long is taken over by another worker')
+    parser.add_argument('--retry_failed', action='store_true',
+                        help='With --worker, clear the failed projects so they run again. Only for a new drain, '
+                             'workers still running may have just written those failures')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Time a few jobs x threads layouts on the first project, the fastest becomes the '
+                             'default and is used for this run')
+    parser.add_argument('--single_pass_audio', action='store_true', help='Decode the mp4 to a 16 kHz wav in one ffmpeg pass, no .aac')
+    parser.add_argument('--stream_audio', action='store_true', help='Pipe ffmpeg straight into whisper, no audio files on disk')
+    parser.add_argument('--report', type=str, default=None,
+                        help='Per project/stage timing report (.json, plus a .csv next to it), default next to the CSV')
+    parser.add_argument('--force', action='store_true', help='Redo every stage even if its inputs are unchanged')
+    parser.add_argument('--keep_wav', action='store_true', help='With --stream_audio, also write the 16 kHz wav to disk')
 
 
 
     args = parser.parse_args()
-    nltk.download('punkt')
-    nltk.download('punkt_tab')
+    if args.chunk_minutes and (args.backend != Backend.WHISPER_CPP or args.stream_audio):
+        parser.error('--chunk_minutes needs the whisper_cpp backend and the wav on disk (no --stream_audio)')
+    if args.action == Action.EXTRACT_AUDIO and args.stream_audio:
+        parser.error('-a extract_audio writes the wav, --stream_audio has no audio stage (use -a extract_srt)')
 
     projects = read_projects(args.project_csv_file, args.filter, args.output_dirname_override)
 
     if args.num_projects:
         projects = projects[:args.num_projects]
 
-    # Note running twice will result
-    if args.action in [Action.CREATE_PROJECT, Action.ALL]:
-        for proj in projects:
-            try:
-                create_project(proj)
-            except Exception as e:
-                print(e)
+    if not projects:
+        parser.error(f"No projects in {args.project_csv_file}" + (f" match --filter {args.filter}" if args.filter else ""))
 
-    if args.action in [Action.EXTRACT_AUDIO, Action.ALL]:
-        for proj in projects:
-            try:
-                extract_audio(proj)
-            except Exception as e:
-                print(e)
+    if args.calibrate:
+        # Saved for this machine and model, plan_layout below picks it up for the run
+        calibrate_layout(projects[0], args.model, args.materialize, args.single_pass_audio, args.stream_audio)
 
-    if args.action in [Action.EXTRACT_SRT, Action.ALL]:
-        for proj in projects:
-            try:
-                extract_srt(proj, args.max_words, args.duration, args.model)
-            except Exception as e:
-                print(e)
+    # With chunks even one project keeps every job busy
+    layout = plan_layout(usable_cores() if args.chunk_minutes else len(projects), args.model, args.srt_jobs,
+                         args.threads)
+    print(f"{layout.jobs} whisper jobs x {layout.threads} threads on {usable_cores()} usable cores"
+          f"{'' if layout.cpu_sets[0] else ', not pinned'}")
+    stages = build_stages(args, layout)
+    if args.worker:
+        queue_dir = os.path.join(args.queue_dir or os.path.join(os.path.dirname(os.path.abspath(args.project_csv_file)),
+                                                                '.whisper_queue', Path(args.project_csv_file).stem),
+                                 queue_run_name(args))
+        queue = WorkQueue(queue_dir, args.lease_seconds)
+        if args.retry_failed:
+            queue.retry_failed()
+        failures, ran = run_worker(stages, projects, queue, args.worker_slots or layout.jobs + 1)
+        print_failures(failures, ran)
+    else:
+        failures = PipelineScheduler(stages).run(projects)
+        print_failures(failures, len(projects))
+
+    report_path = args.report or os.path.join(os.path.dirname(os.path.abspath(args.project_csv_file)),
+                                              f"run_report_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    recorder.write(report_path, str(Path(report_path).with_suffix('.csv')))
+    print(f"Run report written to {report_path}")
+    if failures:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
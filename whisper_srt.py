@@ -1,33 +1,185 @@
+import argparse
+import contextlib
 import faster_whisper
-import math
+import glob
+import json
+import os
+import sys
+from faster_whisper import BatchedInferencePipeline
+from pathlib import Path
+from srt_stream import convert_seconds_to_srt_time, format_cue
 from tqdm import tqdm
 
-model = faster_whisper.WhisperModel("large-v3", device="cuda")
-
-def convert_to_hms(seconds: float) -> str:
-    hours, remainder = divmod(seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    milliseconds = math.floor((seconds % 1) * 1000)
-    output = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02},{milliseconds:03}"
-    return output
-
-def convert_seg(segment: faster_whisper.transcribe.Segment) -> str:
-    return f"{convert_to_hms(segment.start)} --> {convert_to_hms(segment.end)}\n{segment.text.lstrip()}\n\n"
-
-segments, info = model.transcribe("../../audio/African-french-interview-food-16K.WAV")
-
-full_txt = []
-timestamps = 0.0  # for progress bar
-with tqdm(total=info.duration, unit=" audio seconds") as pbar:
-    for i, segment in enumerate(segments, start=1):
-        full_txt.append(f"{i}\n{convert_seg(segment)}")
-        pbar.update(segment.end - timestamps)
-        timestamps = segment.end
-    if timestamps < info.duration: # silence at the end of the audio
-        pbar.update(info.duration - timestamps)
+SAMPLE_RATE = 16000
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.webm'}
+AUDIO_EXTENSIONS = {'.wav', '.mp3', '.m4a', '.aac', '.flac', '.ogg', '.opus'} | VIDEO_EXTENSIONS
+
+def convert_seg(index: int, segment: faster_whisper.transcribe.Segment, offset: float = 0.0) -> str:
+    # offset shifts the times when the audio was transcribed from part way in. Formatted like every other srt the
+    # tools write, one cue at a time since each is written and checkpointed as soon as whisper produces it
+    return format_cue(index, segment.start + offset, segment.end + offset, segment.text.lstrip())
+
+def transcribe(model: faster_whisper.WhisperModel, audio, batch_size: int = 0, **kwargs):
+    # Same (segments, info) as model.transcribe, batched when batch_size is set
+    if not batch_size:
+        return model.transcribe(audio, **kwargs)
+    # Batches are decoded in the order of the audio's VAD chunks, so the segments already come out in timestamp order
+    # and stay a generator, each cue can be written as soon as its batch is done
+    return BatchedInferencePipeline(model=model).transcribe(audio, batch_size=batch_size, **kwargs)
+
+def checkpoint_path(srt_path: str) -> str:
+    return f"{srt_path}.checkpoint.json"
+
+def load_checkpoint(audio_path: str, srt_path: str) -> dict:
+    """
+    Where an interrupted run got to: end (seconds of audio done), index (last cue written), offset (srt bytes
+    that belong to those cues) and the last cue's text. Starts from zero if there is none or it doesn't match.
+    """
+    start = {'audio': os.path.abspath(audio_path), 'end': 0.0, 'index': 0, 'offset': 0, 'text': ''}
+    try:
+        with open(checkpoint_path(srt_path), 'r', encoding='UTF-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return start
+    if checkpoint.get('audio') != start['audio'] or not os.path.exists(srt_path) \
+            or os.path.getsize(srt_path) < checkpoint['offset']:
+        return start
+    return checkpoint
+
+def save_checkpoint(srt_path: str, checkpoint: dict):
+    # Written next to the srt and swapped in, so a crash never leaves half a checkpoint
+    tmp_path = f"{checkpoint_path(srt_path)}.tmp"
+    with open(tmp_path, 'w', encoding='UTF-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path(srt_path))
+
+def transcribe_to_srt(model: faster_whisper.WhisperModel, audio_path: str, srt_path: str, batch_size: int = 0,
+                      pbar: tqdm = None):
+    """
+    Appends each cue to srt_path as soon as whisper produces it, so the srt can be tailed while it runs, and
+    checkpoints after every cue. Run again after a crash and it carries on from the last cue written.
+    pbar is advanced by the audio seconds done, a bar for just this file is shown without one.
+    """
+    checkpoint = load_checkpoint(audio_path, srt_path)
+    audio = faster_whisper.decode_audio(audio_path, sampling_rate=SAMPLE_RATE)
+    duration = len(audio) / SAMPLE_RATE
+    resume_from = checkpoint['end']
+    if resume_from:
+        print(f"Resuming {audio_path} at {convert_seconds_to_srt_time(resume_from)}, cue {checkpoint['index'] + 1}")
+    # The last cue's text keeps whisper's context across the restart
+    segments, info = transcribe(model, audio[int(resume_from * SAMPLE_RATE):], batch_size=batch_size,
+                                initial_prompt=checkpoint['text'] or None)
+
+    if not resume_from:
+        # Saved before the srt is opened, so a crash before the first cue doesn't leave an srt that looks done
+        save_checkpoint(srt_path, checkpoint)
+    mode = "r+" if resume_from else "w"
+    own_pbar = pbar is None
+    if own_pbar:
+        pbar = tqdm(total=duration, unit=" audio seconds")
+    pbar.update(resume_from)
+    with open(srt_path, mode=mode, encoding="UTF-8") as f:
+        # Drop anything written after the last checkpoint, e.g. half a cue
+        f.seek(checkpoint['offset'])
+        f.truncate()
+        timestamps = resume_from  # for progress bar
+        for segment in segments:
+            checkpoint['index'] += 1
+            f.write(convert_seg(checkpoint['index'], segment, resume_from))
+            f.flush()
+            checkpoint.update(end=resume_from + segment.end, offset=f.tell(), text=segment.text.strip())
+            save_checkpoint(srt_path, checkpoint)
+            pbar.update(checkpoint['end'] - timestamps)
+            timestamps = checkpoint['end']
+        if timestamps < duration: # silence at the end of the audio
+            pbar.update(duration - timestamps)
+    if own_pbar:
+        pbar.close()
+    # No checkpoint when whisper found no speech at all
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(checkpoint_path(srt_path))
+
+def find_audio_files(inputs: list) -> list:
+    # Each input is a file, a directory (its audio files) or a glob such as "interviews/**/*.WAV"
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = [str(path) for path in Path(pattern).iterdir() if path.suffix.lower() in AUDIO_EXTENSIONS]
+        elif glob.has_magic(pattern):
+            matches = glob.glob(pattern, recursive=True)
+        else:
+            matches = [pattern]
+        files += sorted(matches)
+    # X.mp4 and X.wav would both write X.srt, keep one per srt and prefer the audio over the video
+    by_srt = {}
+    for path in dict.fromkeys(files):
+        kept = by_srt.setdefault(srt_path_for(path), path)
+        if Path(kept).suffix.lower() in VIDEO_EXTENSIONS and Path(path).suffix.lower() not in VIDEO_EXTENSIONS:
+            by_srt[srt_path_for(path)] = path
+    return list(by_srt.values())
+
+def srt_path_for(audio_path: str) -> str:
+    return str(Path(audio_path).with_suffix('.srt'))
+
+def is_up_to_date(audio_path: str, srt_path: str) -> bool:
+    # A checkpoint means the srt is only part done
+    return os.path.exists(srt_path) and not os.path.exists(checkpoint_path(srt_path)) \
+        and os.path.getmtime(srt_path) >= os.path.getmtime(audio_path)
+
+def audio_duration(audio_path: str) -> float:
+    # From the container header, nothing is decoded
+    import av
+    try:
+        with av.open(audio_path) as container:
+            return container.duration / av.time_base if container.duration else 0.0
+    except av.FFmpegError:
+        return 0.0
+
+def pick_device(device: str, compute_type: str) -> tuple:
+    # auto: the GPU when ctranslate2 sees one, otherwise int8 on the CPU
+    if device == "auto":
+        import ctranslate2
+        device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    if compute_type == "auto":
+        compute_type = "int8" if device == "cpu" else "default"
+    return device, compute_type
 
-with open("../../audio/African-french-interview-food-16K.srt", mode="w", encoding="UTF-8") as f:
-    f.writelines(full_txt)
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe audio files to srt files next to them with faster_whisper')
+    parser.add_argument('inputs', nargs='+', help='Audio files, directories or globs (quote them, ** recurses)')
+    parser.add_argument('-l', '--model', type=str, default="large-v3", help='faster_whisper model name or path')
+    parser.add_argument('--device', type=str, default="auto", help='cuda, cpu or auto')
+    parser.add_argument('--compute_type', type=str, default="auto", help='e.g. int8 or float16, auto is int8 on CPU')
+    # 0 transcribes sequentially. Otherwise the audio is cut into VAD chunks and batch_size chunks go through
+    # the model per forward pass, which also helps a lot on the CPU
+    parser.add_argument('--batch_size', type=int, default=0, help='VAD chunks per forward pass, 0 is sequential')
+    parser.add_argument('--force', action='store_true', help='Transcribe even if the srt is newer than the audio')
+    args = parser.parse_args()
+
+    audio_files = find_audio_files(args.inputs)
+    pending = [path for path in audio_files if args.force or not is_up_to_date(path, srt_path_for(path))]
+    print(f"{len(audio_files)} audio files, {len(audio_files) - len(pending)} already up to date")
+    if not pending:
+        return
+
+    device, compute_type = pick_device(args.device, args.compute_type)
+    print(f"Loading {args.model} ({device}, {compute_type})")
+    # Loaded once, every file goes through the same model
+    model = faster_whisper.WhisperModel(args.model, device=device, compute_type=compute_type)
+
+    failed = []
+    total = sum(audio_duration(path) for path in pending)
+    with tqdm(total=round(total, 1), unit=" audio seconds") as pbar:
+        for audio_path in pending:
+            pbar.set_description(Path(audio_path).name)
+            try:
+                transcribe_to_srt(model, audio_path, srt_path_for(audio_path), args.batch_size, pbar)
+            except Exception as e:
+                print(f"{audio_path}: {e}")
+                failed.append(audio_path)
+    print(f"{len(pending) - len(failed)} of {len(pending)} files transcribed")
+    if failed:
+        sys.exit(1)
 
 
 ## Args/Kwargs.
@@ -35,13 +187,6 @@ with open("../../audio/African-french-interview-food-16K.srt", mode="w", encodin
 
 ## Ali's code 1) Add (extract) Prompts
 
-from dotenv import load_dotenv
-import os
-import openai
-from docx import Document  # For .docx files
-from PyPDF2 import PdfReader  # For .pdf files
-
-load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_API_MODEL = os.getenv("OPENAI_API_MODEL")
 
@@ -59,36 +204,33 @@ def read_txt_file(file_path):
 
 # Function to read text from a Word (.docx) file
 def read_docx_file(file_path):
+    from docx import Document  # For .docx files
     doc = Document(file_path)
     return "\n".join([paragraph.text for paragraph in doc.paragraphs])
 
 
 # Function to read text from a PDF file
 def read_pdf_file(file_path):
-    reader = PdfReader(file_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text()
-    return text
+    from document_ingest import iter_pdf_pages
+    return "".join(iter_pdf_pages(file_path))
+
+
+# Streams the text of multiple files, a paragraph or page at a time, parsed in parallel and cached by content
+def iter_text_from_files(files, workers=None):
+    from document_ingest import iter_documents
+    for file_path, pieces in iter_documents(files, workers=workers):
+        yield from pieces
+        yield "\n\n"
 
 
 # Function to process multiple files and extract their contents
 def extract_text_from_files(files):
-    all_text = ""
-    for file_path in files:
-        if file_path.endswith('.txt'):
-            all_text += read_txt_file(file_path) + "\n\n"
-        elif file_path.endswith('.docx'):
-            all_text += read_docx_file(file_path) + "\n\n"
-        elif file_path.endswith('.pdf'):
-            all_text += read_pdf_file(file_path) + "\n\n"
-        else:
-            print(f"Unsupported file format: {file_path}")
-    return all_text
+    return "".join(iter_text_from_files(files))
 
 
 # Function to interact with OpenAI GPT-4 API and ask for prompts
 def generate_prompts_from_text(text):
+    import openai
     prompt = (
         "You are a helpful assistant. Based on the following content, "
         "summarize and suggest potential prompts for discussion or analysis: \n\n"
@@ -107,8 +249,11 @@ def generate_prompts_from_text(text):
     return response["choices"][0]["message"]["content"]
 
 
-# Main function
-def main():
+# Main function of the prompt generation
+def generate_prompts_main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
     # Step 1: Specify the files to process
     files = [
         "example1.txt",
@@ -129,9 +274,6 @@ def main():
     print(prompts)
 
 
-if __name__ == "__main__":
-    main()
-
 
 
 
@@ -149,14 +291,15 @@ def init_gpt_model(api_key, model, initial_prompt):
     )
     return response
 
-##load API
-api_key = os.getenv('OPENAI_API_KEY')
-model = os.getenv('OPENAI_API_MODEL', 'gpt-4')
-initial_prompt = "You are a helpful assistant specialized in data extraction and analysis."
+def init_default_gpt_model():
+    ##load API
+    api_key = os.getenv('OPENAI_API_KEY')
+    model = os.getenv('OPENAI_API_MODEL', 'gpt-4')
+    initial_prompt = "You are a helpful assistant specialized in data extraction and analysis."
 
-# Initialize GPT model with the prompt
-response = init_gpt_model(api_key, model, initial_prompt)
-print(response["choices"][0]["message"]["content"])
+    # Initialize GPT model with the prompt
+    response = init_gpt_model(api_key, model, initial_prompt)
+    print(response["choices"][0]["message"]["content"])
 
 
 
@@ -169,5 +312,5 @@ print(response["choices"][0]["message"]["content"])
 ##step2 to Google Cloud Console
 
 
-
-
+if __name__ == "__main__":
+    main()
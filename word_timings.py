@@ -0,0 +1,51 @@
+import json
+import re
+from collections import namedtuple
+from typing import Iterable, List
+
+# Times are in milliseconds, word keeps whisper's leading space so ''.join(words) gives back the segment text
+Word = namedtuple('Word', ['start', 'end', 'word'])
+WordSegment = namedtuple('WordSegment', ['start', 'end', 'words'])
+
+SIDECAR_VERSION = 1
+SPECIAL_TOKEN = re.compile(r'^\[_[A-Z]+_?\d*\]$')
+
+
+def words_from_whisper_cpp_json(json_path: str) -> List[WordSegment]:
+    """
+    Reads whisper.cpp's full json output (-ojf) and merges sub-word tokens into words.
+    A token starting with a space starts a new word.
+    """
+    with open(json_path, 'r', encoding='utf-8', errors='replace') as file:
+        transcription = json.load(file)['transcription']
+
+    segments = []
+    for segment in transcription:
+        words = []
+        for token in segment.get('tokens', []):
+            text = token['text']
+            if SPECIAL_TOKEN.match(text) or 'offsets' not in token:
+                continue
+            start, end = token['offsets']['from'], token['offsets']['to']
+            if words and not text.startswith(' '):
+                words[-1] = Word(words[-1].start, end, words[-1].word + text)
+            else:
+                words.append(Word(start, end, text))
+        segments.append(WordSegment(segment['offsets']['from'], segment['offsets']['to'], words))
+    return segments
+
+
+def save_word_timings(sidecar_path: str, segments: Iterable[WordSegment]):
+    # Compact: one array per segment, one [start, end, word] triple per word
+    data = {'version': SIDECAR_VERSION,
+            'segments': [[seg.start, seg.end, [[w.start, w.end, w.word] for w in seg.words]] for seg in segments]}
+    with open(sidecar_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, separators=(',', ':'))
+
+
+def load_word_timings(sidecar_path: str) -> List[WordSegment]:
+    with open(sidecar_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    if data.get('version') != SIDECAR_VERSION:
+        raise ValueError(f"Unsupported word timings version {data.get('version')} in {sidecar_path}")
+    return [WordSegment(start, end, [Word(*word) for word in words]) for start, end, words in data['segments']]
@@ -0,0 +1,178 @@
+import json
+import os
+import platform
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Optional
+
+# A lease whose heartbeat hasn't moved for this long belongs to a dead worker
+LEASE_SECONDS = 120
+
+
+class WorkQueue:
+    """
+    Job queue shared by workers on several hosts through a directory on a shared (NFS) filesystem. Lock files are
+    used rather than SQLite, whose locking is not reliable over NFS.
+
+    <job>.lease   created with O_EXCL by the worker that claims the job, its mtime is the heartbeat
+    <job>.done    the job finished, <job>.failed the job failed (with the error), neither is claimed again
+                  (retry_failed() clears the failures, for a new run only)
+
+    Staleness is judged by how long a lease's mtime has not changed on this host's own clock, so clock skew between
+    hosts doesn't matter. A stale lease is reclaimed by renaming it away. If by then another worker already reclaimed
+    it and made a new lease, the rename takes that one instead, so it is checked and put back.
+    """
+
+    def __init__(self, queue_dir: str, lease_seconds: float = LEASE_SECONDS):
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{platform.node()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._held = set()
+        self._seen: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+        os.makedirs(queue_dir, exist_ok=True)
+
+    def _path(self, job_id: str, kind: str) -> str:
+        return os.path.join(self.queue_dir, f"{job_id}.{kind}")
+
+    def retry_failed(self):
+        # Gives failed jobs another go, the failure is printed so it isn't lost. Only call it when no other worker is
+        # draining the queue, or their deterministic failures are run again by every worker that starts
+        for name in os.listdir(self.queue_dir):
+            if name.endswith('.failed'):
+                print(f"Retrying {name[:-len('.failed')]}, it failed before")
+                try:
+                    os.remove(os.path.join(self.queue_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def is_finished(self, job_id: str) -> bool:
+        return os.path.exists(self._path(job_id, 'done')) or os.path.exists(self._path(job_id, 'failed'))
+
+    def claim(self, job_id: str) -> bool:
+        if self.is_finished(job_id):
+            return False
+        lease_path = self._path(job_id, 'lease')
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if not self._is_stale(job_id, lease_path) or not self._reclaim(job_id, lease_path):
+                return False
+            return self.claim(job_id)
+        with os.fdopen(fd, 'w') as file:
+            json.dump({'worker': self.worker_id, 'claimed': time.time()}, file)
+        # The job may have finished between the check above and the claim
+        if self.is_finished(job_id):
+            os.remove(lease_path)
+            return False
+        with self._lock:
+            self._held.add(job_id)
+        return True
+
+    def claim_next(self, job_ids: Iterable[str]) -> Optional[str]:
+        for job_id in job_ids:
+            if self.claim(job_id):
+                return job_id
+        return None
+
+    @staticmethod
+    def _lease_version(path: str) -> tuple:
+        # Which lease file and which heartbeat, a new lease differs in inode or mtime
+        stat = os.stat(path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _is_stale(self, job_id: str, lease_path: str) -> bool:
+        try:
+            version = self._lease_version(lease_path)
+        except FileNotFoundError:
+            return True
+        seen = self._seen.get(job_id)
+        if seen is None or seen[0] != version:
+            self._seen[job_id] = (version, time.monotonic())
+            return False
+        return time.monotonic() - seen[1] > self.lease_seconds
+
+    def _reclaim(self, job_id: str, lease_path: str) -> bool:
+        stale_path = f"{lease_path}.stale.{uuid.uuid4().hex[:8]}"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            # Another worker got there first, or the job just finished
+            return not self.is_finished(job_id)
+        seen = self._seen.get(job_id)
+        if seen is not None and self._lease_version(stale_path) != seen[0]:
+            # Another worker reclaimed it first and this is its new lease, put it back unless a lease exists again
+            try:
+                os.link(stale_path, lease_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            self._seen.pop(job_id, None)
+            return False
+        os.remove(stale_path)
+        print(f"Reclaimed {job_id} from a dead worker")
+        self._seen.pop(job_id, None)
+        return True
+
+    def holds(self, job_id: str) -> bool:
+        # Still this worker's job, False once another worker took the lease over
+        with self._lock:
+            if job_id not in self._held:
+                return False
+        return self.owns(job_id)
+
+    def owns(self, job_id: str) -> bool:
+        try:
+            with open(self._path(job_id, 'lease'), 'r') as file:
+                return json.load(file).get('worker') == self.worker_id
+        except (OSError, ValueError):
+            return False
+
+    def _finish(self, job_id: str, kind: str, **info):
+        tmp_path = f"{self._path(job_id, kind)}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(dict(worker=self.worker_id, finished=time.time(), **info), file)
+        os.replace(tmp_path, self._path(job_id, kind))
+        with self._lock:
+            self._held.discard(job_id)
+        if self.owns(job_id):
+            os.remove(self._path(job_id, 'lease'))
+
+    def complete(self, job_id: str):
+        self._finish(job_id, 'done')
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, 'failed', error=error)
+
+    def start_heartbeat(self, on_lost: Callable[[str], None] = None):
+        """
+        Touches every lease this worker holds, from a thread, so long stages keep their leases.
+        on_lost(job_id) is called from that thread when another worker took a lease over, to stop the job's work.
+        """
+        def beat():
+            while not self._stop.wait(self.lease_seconds / 4):
+                with self._lock:
+                    held = list(self._held)
+                for job_id in held:
+                    if not self.owns(job_id):
+                        print(f"Lost the lease on {job_id}, another worker reclaimed it")
+                        with self._lock:
+                            self._held.discard(job_id)
+                        if on_lost:
+                            on_lost(job_id)
+                        continue
+                    try:
+                        os.utime(self._path(job_id, 'lease'))
+                    except OSError as e:
+                        print(f"Heartbeat for {job_id} failed: {e}")
+
+        self._heartbeat = threading.Thread(target=beat, name='queue_heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def stop_heartbeat(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()